@@ -0,0 +1,139 @@
+import argparse
+import os
+import signal
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from brewio import IteratorSource
+
+# Runs many Brewin programs on a pool of worker processes.
+#
+#   results = run_batch([(program, inputs), ...], workers=8, timeout=5)
+#
+# Every job is (program source, list of input lines or None). None or an
+# empty list means no input at all: inputi() fails the job instead of
+# reading the worker's stdin, which the workers share. Results come
+# back in job order as JobResult objects. Workers load the parser tables and
+# import the interpreter once, when they start, so jobs only pay for parsing
+# and running their own program. A job that runs longer than timeout seconds
+# is stopped (SIGALRM, so timeouts need a Unix worker, and run_job called
+# from any other thread than the main one runs without a timeout) and
+# reported with timed_out set.
+
+
+class JobTimeout(BaseException):   # not an Exception, so nothing in the interpreter catches it
+    pass
+
+
+class JobResult:
+    __slots__ = ("output", "error_type", "error_line", "error", "timed_out", "elapsed")
+
+    def __init__(self, output, error_type=None, error_line=None, error=None, timed_out=False, elapsed=0.0):
+        self.output = output   # lines printed before the program ended
+        self.error_type = error_type   # ErrorType of a Brewin error, None otherwise
+        self.error_line = error_line   # line the Brewin error happened on, if known
+        self.error = error   # message of whatever stopped the program, None if it finished
+        self.timed_out = timed_out
+        self.elapsed = elapsed   # seconds spent on the job in the worker
+
+    def __repr__(self):
+        return (f"JobResult(output={self.output!r}, error_type={self.error_type}, error_line={self.error_line}, "
+                f"error={self.error!r}, timed_out={self.timed_out})")
+
+
+worker_options = {}   # Interpreter keyword arguments, set in each worker by warm_worker
+
+
+def warm_worker(options):   # pool initializer: load everything a job needs up front
+    from interpreterv2 import Interpreter
+
+    worker_options.update(options)
+    Interpreter(console_output=False, **options).run("func main() { print(1); }")   # builds lexer and parser
+
+
+def raise_timeout(signum, frame):
+    raise JobTimeout()
+
+
+def run_job(job, timeout=None):   # runs one (program, inputs) job, also usable without a pool
+    from interpreterv2 import Interpreter
+
+    program, inputs = job
+    if not inputs:
+        inputs = IteratorSource(())   # empty source, the interpreter would fall back to input() for None or []
+    interpreter = Interpreter(console_output=False, inp=inputs, **worker_options)
+    use_timer = (timeout and hasattr(signal, "setitimer")   # main thread of a Unix process only
+                 and threading.current_thread() is threading.main_thread())
+    start = time.perf_counter()
+    result = JobResult(output=None)
+    try:
+        if use_timer:
+            signal.signal(signal.SIGALRM, raise_timeout)
+            signal.setitimer(signal.ITIMER_REAL, timeout)
+        try:
+            interpreter.run(program)
+        finally:   # disarmed inside the outer try, so a timer firing right at the end is still caught below
+            if use_timer:
+                signal.setitimer(signal.ITIMER_REAL, 0)
+    except JobTimeout:
+        result.timed_out = True
+        result.error = f"timed out after {timeout}s"
+    except Exception as e:
+        result.error = str(e)
+        if interpreter.error_type is not None:
+            result.error_type = interpreter.error_type
+            result.error_line = interpreter.error_line
+    result.elapsed = time.perf_counter() - start
+    result.output = interpreter.get_output()
+    return result
+
+
+def run_chunk(jobs, timeout):
+    return [run_job(job, timeout) for job in jobs]
+
+
+# runs every job and returns their JobResults in the same order.
+# options are passed to Interpreter (engine, optimize, ...)
+def run_batch(jobs, workers=None, timeout=None, chunk_size=None, **options):
+    jobs = list(jobs)
+    if not jobs:
+        return []
+    workers = workers or os.cpu_count() or 1
+    if chunk_size is None:   # a few chunks per worker, so a slow chunk doesn't leave the others idle
+        chunk_size = max(1, len(jobs) // (workers * 4))
+    chunks = [jobs[i:i + chunk_size] for i in range(0, len(jobs), chunk_size)]
+    results = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=warm_worker, initargs=(options,)) as pool:
+        for chunk_results in pool.map(run_chunk, chunks, [timeout] * len(chunks)):
+            results.extend(chunk_results)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run Brewin programs on a process pool")
+    parser.add_argument("programs", nargs="+", help="Brewin source files")
+    parser.add_argument("--workers", type=int, help="worker processes (default: one per core)")
+    parser.add_argument("--timeout", type=float, help="seconds a program may run")
+    parser.add_argument("--engine", default="tree", help="interpreter engine")
+    args = parser.parse_args(argv)
+
+    jobs = []
+    for path in args.programs:
+        with open(path) as f:
+            jobs.append((f.read(), None))
+    results = run_batch(jobs, workers=args.workers, timeout=args.timeout, engine=args.engine)
+    failed = 0
+    for path, result in zip(args.programs, results):
+        if result.error is None:
+            status = "ok"
+        else:
+            failed += 1
+            status = result.error
+        print(f"{path}: {status} ({len(result.output)} lines, {result.elapsed:.3f}s)")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,342 @@
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# Benchmarks for the lexer, parser and interpreter.
+#
+#   python brewbench.py                          every benchmark on the tree engine
+#   python brewbench.py --engines tree,vm        compare two (or more) engines
+#   python brewbench.py --revs HEAD~3,HEAD       compare two git revisions
+#   python brewbench.py --bench loop,print --repeat 5 --scale 0.2
+#
+# Every benchmark is timed in three phases: lexing the source, parsing it
+# (parse_program, which lexes again as it goes) and executing the parsed
+# program. Times are the best of --repeat runs; peak memory comes from one
+# extra run under tracemalloc, so tracing doesn't slow the timed runs.
+# Output hashes are compared too, a different hash means the configurations
+# don't print the same thing.
+#
+# Revisions are compared by extracting each one with git archive into a
+# temporary directory and running this script there with --json, so it also
+# works for revisions older than the script itself.
+
+
+def arith_benchmark(n):
+    source = f"""
+func main() {{
+  var i;
+  var x;
+  x = 0;
+  for (i = 0; i < {n}; i = i + 1) {{
+    x = ((i * 3 + 7) / 2 - (i - 1) * 2 + (5 * (i + 2) - 4) / 3) - x / 1000 + (i * i - i) / (i + 1);
+  }}
+  print(x);
+}}
+"""
+    return source, None, n
+
+
+def loop_benchmark(n):
+    source = f"""
+func main() {{
+  var i;
+  var total;
+  total = 0;
+  for (i = 0; i < {n}; i = i + 1) {{
+    total = total + i;
+  }}
+  print(total);
+}}
+"""
+    return source, None, n
+
+
+def recursion_benchmark(n):
+    source = f"""
+func fib(n) {{
+  if (n < 2) {{
+    return n;
+  }} else {{
+    return fib(n - 1) + fib(n - 2);
+  }}
+}}
+
+func main() {{
+  print(fib({n}));
+}}
+"""
+    calls = [1, 1]   # calls made by fib(k)
+    while len(calls) <= n:
+        calls.append(calls[-1] + calls[-2] + 1)
+    return source, None, calls[n]
+
+
+def print_benchmark(n):
+    source = f"""
+func main() {{
+  var i;
+  for (i = 0; i < {n}; i = i + 1) {{
+    print("line ", i, " of ", {n});
+  }}
+}}
+"""
+    return source, None, n
+
+
+def input_benchmark(n):
+    source = f"""
+func main() {{
+  var i;
+  var total;
+  total = 0;
+  for (i = 0; i < {n}; i = i + 1) {{
+    total = total + inputi();
+  }}
+  print(total);
+}}
+"""
+    return source, [str(i % 1000) for i in range(n)], n
+
+
+def functions_benchmark(n):   # n small functions, main calls every one of them 20 times
+    rounds = 20
+    parts = []
+    for k in range(n):
+        parts.append(f"""
+func f{k}(a) {{
+  var b;
+  b = a + {k};
+  return b - {k} + 1;
+}}
+""")
+    calls = "\n".join(f"    x = f{k}(x);" for k in range(n))
+    parts.append(f"""
+func main() {{
+  var r;
+  var x;
+  x = 0;
+  for (r = 0; r < {rounds}; r = r + 1) {{
+{calls}
+  }}
+  print(x);
+}}
+""")
+    return "".join(parts), None, n * rounds
+
+
+# name -> (function building (source, input lines, ops), size at scale 1)
+BENCHMARKS = {
+    "arith": (arith_benchmark, 20000),
+    "loop": (loop_benchmark, 100000),
+    "recursion": (recursion_benchmark, 18),
+    "print": (print_benchmark, 20000),
+    "input": (input_benchmark, 20000),
+    "functions": (functions_benchmark, 300),
+}
+
+
+def quiet_import(name):   # older revisions run a demo program (reading stdin) when interpreterv2 is imported
+    stdin = sys.stdin
+    sys.stdin = io.StringIO("1\n" * 100)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            return __import__(name)
+    finally:
+        sys.stdin = stdin
+
+
+def count_nodes(node):
+    if isinstance(node, list):
+        return sum(count_nodes(item) for item in node)
+    if not hasattr(node, "elem_type"):
+        return 0
+    return 1 + sum(count_nodes(value) for value in node.dict.values())
+
+
+def make_interpreter(interpreterv2, engine, inp):
+    try:
+        return interpreterv2.Interpreter(console_output=False, inp=inp, engine=engine)
+    except TypeError:   # revision without engines
+        if engine != "tree":
+            raise
+        return interpreterv2.Interpreter(console_output=False, inp=inp)
+
+
+def best_time(function, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def run_benchmark(name, engine, repeat, scale):
+    brewlex = quiet_import("brewlex")
+    brewparse = quiet_import("brewparse")
+    interpreterv2 = quiet_import("interpreterv2")
+    build, size = BENCHMARKS[name]
+    if name == "recursion":   # the work grows exponentially with n
+        n = max(2, size + round((scale - 1) * 4))
+    else:
+        n = max(1, int(size * scale))
+    source, inp, ops = build(n)
+
+    def lex():
+        if hasattr(brewlex, "get_lexer"):
+            lexer = brewlex.get_lexer().clone()
+        else:   # revision that builds the lexer at import
+            lexer = brewlex.lexer.clone()
+        lexer.input(source)
+        count = 0
+        for _ in iter(lexer.token, None):
+            count += 1
+        return count
+
+    def parse():
+        return brewparse.parse_program(source)
+
+    outputs = []
+
+    def execute(trace_memory=False):
+        interpreter = make_interpreter(interpreterv2, engine, list(inp) if inp else None)
+        if hasattr(interpreter, "run_program"):
+            ast = parse()
+            if trace_memory:   # the peak of the run, not of the parse
+                tracemalloc.reset_peak()
+            start = time.perf_counter()
+            interpreter.run_program(ast)
+            elapsed = time.perf_counter() - start
+        else:   # only run() exists, take the parsing time back out
+            start = time.perf_counter()
+            interpreter.run(source)
+            elapsed = time.perf_counter() - start - parse_time
+        outputs.append(interpreter.get_output())
+        return elapsed
+
+    tokens = lex()
+    lex_time = best_time(lex, repeat)
+    nodes = count_nodes(parse())
+    parse_time = best_time(parse, repeat)
+    exec_time = min(execute() for _ in range(repeat))
+
+    tracemalloc.start()
+    parse()
+    parse_peak = tracemalloc.get_traced_memory()[1]
+    execute(trace_memory=True)
+    exec_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    output_hash = hashlib.sha256("\n".join(map(str, outputs[0])).encode()).hexdigest()[:12]
+    return {
+        "n": n, "tokens": tokens, "nodes": nodes, "ops": ops,
+        "lex": lex_time, "parse": parse_time, "exec": exec_time,
+        "parse_peak": parse_peak, "exec_peak": exec_peak, "output": output_hash,
+    }
+
+
+def run_suite(names, engine, repeat, scale):
+    results = {}
+    for name in names:
+        try:
+            results[name] = run_benchmark(name, engine, repeat, scale)
+        except Exception as e:   # a benchmark this engine/revision can't run is reported, not fatal
+            results[name] = {"error": f"{type(e).__name__}: {e}"}
+    return results
+
+
+def run_revision(rev, names, engine, repeat, scale):   # the suite on a git revision, in a subprocess
+    root = os.path.dirname(os.path.abspath(__file__))
+    tmp = tempfile.mkdtemp(prefix="brewbench-")
+    try:
+        archive = subprocess.run(["git", "archive", rev], cwd=root, check=True, capture_output=True).stdout
+        subprocess.run(["tar", "-x", "-C", tmp], input=archive, check=True)
+        shutil.copy(os.path.abspath(__file__), os.path.join(tmp, "brewbench.py"))
+        command = [sys.executable, "brewbench.py", "--json", "--engines", engine, "--repeat", str(repeat),
+                   "--scale", str(scale), "--bench", ",".join(names)]
+        result = subprocess.run(command, cwd=tmp, check=True, capture_output=True, text=True)
+        return json.loads(result.stdout)[engine]
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def rate(count, seconds):
+    if not seconds or seconds <= 0:
+        return "-"
+    per_second = count / seconds
+    if per_second >= 1e6:
+        return f"{per_second / 1e6:.2f}M/s"
+    if per_second >= 1e3:
+        return f"{per_second / 1e3:.1f}k/s"
+    return f"{per_second:.0f}/s"
+
+
+def report(results, names):   # results: config label -> benchmark name -> numbers
+    labels = list(results)
+    lines = []
+    for name in names:
+        lines.append(name)
+        baseline = results[labels[0]].get(name, {})
+        for label in labels:
+            r = results[label].get(name, {})
+            if "error" in r or not r:
+                lines.append(f"  {label:<16} error: {r.get('error', 'not run')}")
+                continue
+            ratio = ""
+            if label != labels[0] and baseline.get("exec"):
+                ratio = f"  x{r['exec'] / baseline['exec']:.2f} exec time"
+                if r["output"] != baseline.get("output"):
+                    ratio += "  (different output)"
+            lines.append(
+                f"  {label:<16} lex {r['lex'] * 1000:8.2f}ms {rate(r['tokens'], r['lex']):>10} tokens"
+                f" | parse {r['parse'] * 1000:8.2f}ms {rate(r['nodes'], r['parse']):>10} nodes"
+                f" | exec {r['exec'] * 1000:9.2f}ms {rate(r['ops'], r['exec']):>10} ops"
+                f" | peak parse {r['parse_peak'] / 1024:8.0f}KB exec {r['exec_peak'] / 1024:8.0f}KB"
+                f"{ratio}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the Brewin lexer, parser and interpreter")
+    parser.add_argument("--bench", default=",".join(BENCHMARKS), help="comma separated benchmarks to run")
+    parser.add_argument("--engines", default="tree", help="comma separated engines to compare")
+    parser.add_argument("--revs", help="comma separated git revisions to compare (uses the first engine)")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per phase, the best one is reported")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiplier for the benchmark sizes")
+    parser.add_argument("--json", action="store_true", help="print raw results as json")
+    parser.add_argument("--output", help="also write the report to this file (e.g. bench_output.txt)")
+    args = parser.parse_args(argv)
+
+    names = [name for name in args.bench.split(",") if name]
+    for name in names:
+        if name not in BENCHMARKS:
+            parser.error(f"unknown benchmark {name}, expected one of {', '.join(BENCHMARKS)}")
+    engines = [engine for engine in args.engines.split(",") if engine]
+
+    results = {}
+    if args.revs:
+        for rev in args.revs.split(","):
+            results[rev] = run_revision(rev, names, engines[0], args.repeat, args.scale)
+    else:
+        for engine in engines:
+            results[engine] = run_suite(names, engine, args.repeat, args.scale)
+
+    text = json.dumps(results, indent=2) if args.json else report(results, names)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+from collections import OrderedDict
+
+from brewparse import parse_program
+
+# Cache of parsed programs, keyed by a hash of the program source, so running
+# the same program again skips lexing and parsing.
+#
+# The in-process cache keeps the most recently used ASTs (LRU, bounded by
+# max_entries). With cache_dir set, ASTs are also pickled to disk so other
+# processes can reuse them; the directory is trimmed back to max_disk_bytes,
+# oldest files first. Only point cache_dir at a directory you trust, the
+# files are unpickled.
+#
+# Engines annotate AST nodes (frame slots, call targets), those annotations
+# only depend on the program so a cached AST can be shared between runs.
+
+
+class ASTCache:
+    VERSION = "8"   # bump when the AST classes change, old disk entries are then ignored
+
+    def __init__(self, max_entries=256, cache_dir=None, max_disk_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.entries = OrderedDict()   # key -> ast, least recently used first
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, program):
+        return hashlib.sha256((self.VERSION + "\0" + program).encode()).hexdigest()
+
+    # drop-in replacement for brewparse.parse_program
+    def parse(self, program):
+        key = self.key(program)
+        with self.lock:
+            ast = self.entries.get(key)
+            if ast is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return ast
+
+        ast = self.load(key)
+        if ast is not None:
+            with self.lock:
+                self.disk_hits += 1
+        else:
+            ast = parse_program(program)   # syntax errors are raised and never cached
+            with self.lock:
+                self.misses += 1
+            self.store(key, ast)
+
+        with self.lock:
+            self.entries[key] = ast
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return ast
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key + ".ast")
+
+    def load(self, key):
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self.path(key), "rb") as f:
+                ast = pickle.load(f)
+            os.utime(self.path(key))   # trim_disk drops the least recently used files
+            return ast
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+            return None   # missing or unreadable entry, parse again
+
+    def store(self, key, ast):
+        if not self.cache_dir:
+            return
+        try:   # write to a temp file and rename, so readers never see half an entry
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        except OSError:
+            return
+        try:
+            with os.fdopen(fd, "wb") as f:
+                pickle.dump(ast, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.path(key))
+        except (OSError, pickle.PicklingError, RecursionError):
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return
+        self.trim_disk()
+
+    def trim_disk(self):
+        files = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".ast"):
+                try:
+                    stat = os.stat(os.path.join(self.cache_dir, name))
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in files)
+        for _, size, name in sorted(files):   # oldest first
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except OSError:
+                pass
+            total -= size
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "entries": len(self.entries),
+            }
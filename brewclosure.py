@@ -0,0 +1,527 @@
+from intbase import BrewinException, ErrorType, InterpreterBase
+from brewresolve import Resolver
+from brewpure import MemoCache
+
+# Compiles the AST produced by brewparse into a tree of python closures.
+# Every node is looked at once, at compile time: the closure for a node has
+# its operator and child closures bound in, so running the program never
+# compares elem_type strings again.
+#
+# Compiled closures take one argument, frame, the list holding the variables
+# of the function that is currently running (slots come from brewresolve).
+# Statement closures return None to keep going, or a 1-tuple (value,) when
+# a return statement was executed. "return f(...)" inside f itself stores the
+# new args into the running frame and returns TAIL_CALL, the call closure then
+# runs the body again instead of recursing.
+
+TAIL_CALL = ("tail call",)   # compared by identity
+
+
+class CompiledFunction:
+    def __init__(self, name, nparams):
+        self.name = name
+        self.nparams = nparams
+        self.nslots = nparams   # frame size, set by the resolver
+        self.body = None   # filled in once every function has a holder
+
+
+class ClosureCompiler:
+    ARITH_OPS = {"+", "-", "*", "/"}
+    COMPARE_OPS = {"==", "!=", "<", "<=", ">", ">="}
+
+    def __init__(self, interpreter):
+        self.interpreter = interpreter   # used for errors, output and input
+        self.functions = {}   # (name, arity) -> CompiledFunction
+        self.current_function = None   # CompiledFunction whose body is being compiled
+        self.try_depth = 0   # try blocks around the statement being compiled, in the current function
+        self.statement_compilers = {
+            InterpreterBase.VAR_DEF_NODE: self.compile_vardef,
+            "=": self.compile_assignment,
+            InterpreterBase.IF_NODE: self.compile_if,
+            InterpreterBase.FOR_NODE: self.compile_for,
+            InterpreterBase.RETURN_NODE: self.compile_return,
+            InterpreterBase.TRY_NODE: self.compile_try,
+            InterpreterBase.RAISE_NODE: self.compile_raise,
+        }
+
+    # compile a whole program, returns a closure that runs main()
+    def compile_program(self, ast):
+        Resolver().resolve_program(ast)
+        main_func = None
+        function_nodes = {}
+        for function_node in ast.get("functions"):   # first pass: holders, so calls can bind to them
+            func = CompiledFunction(function_node.get("name"), len(function_node.get("args")))
+            func.nslots = function_node.nslots
+            self.functions[(func.name, func.nparams)] = func   # a later duplicate definition wins
+            function_nodes[(func.name, func.nparams)] = function_node
+            if func.name == "main":
+                main_func = func
+        if main_func is None:
+            self.interpreter.error(ErrorType.NAME_ERROR, "No main() function was found")
+
+        for func_key, function_node in function_nodes.items():   # second pass: bodies
+            self.current_function = self.functions[func_key]
+            self.current_function.body = self.compile_function_body(function_node)
+        self.current_function = None
+
+        def run_main():
+            frame = [None] * main_func.nslots
+            while main_func.body(frame) is TAIL_CALL:
+                pass
+        return run_main
+
+    def compile_function_body(self, function_node):
+        if function_node.resolve_error is not None:
+            error_type, description = function_node.resolve_error
+            error = self.interpreter.error
+            line = function_node.line
+
+            def bad_function(frame):
+                error(error_type, description, line)
+            body = bad_function
+        else:
+            body = self.compile_block(function_node.get("statements"))
+        if self.interpreter.profiler is not None:
+            body = self.profile_function(function_node, body)
+        return body
+
+    def profile_function(self, function_node, body):   # body wrapped in profiler enter/exit
+        profiler = self.interpreter.profiler
+        name = function_node.get("name")
+        line = function_node.line
+
+        def profiled_body(frame):
+            profiler.enter(name, line)
+            try:
+                result = body(frame)
+                while result is TAIL_CALL:   # self tail calls stay inside one profiled call
+                    result = body(frame)
+                return result
+            finally:
+                profiler.exit()
+        return profiled_body
+
+    def compile_block(self, statements):
+        closures = tuple(self.compile_statement(s) for s in statements or [])
+        if len(closures) == 1:
+            return closures[0]
+
+        def run_block(frame):
+            for statement in closures:
+                result = statement(frame)
+                if result is not None:
+                    return result
+        return run_block
+
+    def compile_statement(self, node):
+        statement = self.compile_plain_statement(node)
+        if self.interpreter.profiler is None or node.get("line") is None:
+            return statement
+        count_line = self.interpreter.profiler.count_line
+        line = node.get("line")
+
+        def counted(frame):
+            count_line(line)
+            return statement(frame)
+        return counted
+
+    def compile_plain_statement(self, node):
+        compiler = self.statement_compilers.get(node.elem_type)
+        if compiler is not None:
+            return compiler(node)
+        expression = self.compile_expression(node)   # expression statement, value is dropped
+
+        def run_expression(frame):
+            expression(frame)
+        return run_expression
+
+    def compile_resolve_error(self, node):   # closure raising the error the resolver found
+        error_type, description = node.resolve_error
+        error = self.interpreter.error
+        line = node.line
+
+        def resolve_error(frame):
+            error(error_type, description, line)
+        return resolve_error
+
+    def compile_vardef(self, node):
+        if node.resolve_error is not None:
+            return self.compile_resolve_error(node)
+        slot = node.slot
+        initial_value = self.interpreter.initial_value(node.get("var_type"))
+
+        def define(frame):
+            frame[slot] = initial_value
+        return define
+
+    def compile_assignment(self, node):
+        expression = self.compile_expression(node.get("expression"))
+        if node.resolve_error is not None:
+            resolve_error = self.compile_resolve_error(node)
+
+            def bad_assign(frame):
+                expression(frame)
+                resolve_error(frame)
+            return bad_assign
+        slot = node.slot
+        path = node.field_path
+        if path is not None:   # struct field
+            error = self.interpreter.error
+            line = node.line
+
+            def assign_field(frame):
+                value = expression(frame)
+                path.set(frame[slot], value, error, line)
+            return assign_field
+
+        def assign(frame):
+            frame[slot] = expression(frame)
+        return assign
+
+    def compile_if(self, node):
+        condition = self.compile_expression(node.get("condition"))
+        then_block = self.compile_block(node.get("statements"))
+        else_block = self.compile_block(node.get("else_statements"))
+        error = self.interpreter.error
+        line = node.line
+
+        def run_if(frame):
+            flag = condition(frame)
+            if flag is True:
+                return then_block(frame)
+            if flag is False:
+                return else_block(frame)
+            error(ErrorType.TYPE_ERROR, "Incompatible types for if statement condition: " + str(flag), line)
+        return run_if
+
+    def compile_for(self, node):
+        init = self.compile_statement(node.get("init"))
+        condition = self.compile_expression(node.get("condition"))
+        update = self.compile_statement(node.get("update"))
+        body = self.compile_block(node.get("statements"))
+        error = self.interpreter.error
+        line = node.line
+
+        def run_for(frame):
+            init(frame)
+            while True:
+                flag = condition(frame)
+                if flag is not True:
+                    if flag is False:
+                        return None
+                    error(ErrorType.TYPE_ERROR, "Incompatible types for for loop condition: " + str(flag), line)
+                result = body(frame)
+                if result is not None:
+                    return result
+                update(frame)
+        return run_for
+
+    # handlers are found through a table built here, entering the try costs
+    # nothing (python's try is free until something is raised)
+    def compile_try(self, node):
+        self.try_depth += 1
+        body = self.compile_block(node.get("statements"))
+        self.try_depth -= 1
+        handlers = {}   # exception string -> block of the first catcher for it
+        for catcher in node.get("catchers"):
+            if catcher.get("exception_type") not in handlers:
+                handlers[catcher.get("exception_type")] = self.compile_block(catcher.get("statements"))
+
+        def run_try(frame):
+            try:
+                return body(frame)
+            except BrewinException as e:
+                handler = handlers.get(e.exception_type)
+                if handler is None:   # an outer try (or a caller) gets it
+                    raise
+            return handler(frame)
+        return run_try
+
+    def compile_raise(self, node):
+        expression = self.compile_expression(node.get("exception_type"))
+        get_type = self.interpreter.get_type
+        error = self.interpreter.error
+        line = node.line
+
+        def run_raise(frame):
+            exception_type = expression(frame)
+            if type(exception_type) is not str:
+                error(ErrorType.TYPE_ERROR, "Incompatible type for raise: " + get_type(exception_type), line)
+            raise BrewinException(exception_type, line)
+        return run_raise
+
+    def compile_return(self, node):
+        if node.get("expression") is None:
+            return lambda frame: (None,)
+        if self.is_self_tail_call(node.get("expression")):
+            return self.compile_tail_call(node.get("expression"))
+        expression = self.compile_expression(node.get("expression"))
+
+        def run_return(frame):
+            return (expression(frame),)
+        return run_return
+
+    def is_self_tail_call(self, node):
+        if node.elem_type != InterpreterBase.FCALL_NODE or node.get("name") in ("print", "inputi"):
+            return False
+        if self.try_depth:   # the catchers must still see exceptions from the call
+            return False
+        func = self.functions.get((node.get("name"), len(node.get("args"))))
+        return func is not None and func is self.current_function
+
+    def compile_tail_call(self, node):   # return f(...) inside f, reuses the running frame
+        args = tuple(self.compile_expression(arg) for arg in node.get("args"))
+        nparams = len(args)
+
+        def tail_call(frame):
+            frame[:nparams] = [arg(frame) for arg in args]   # every arg is evaluated before any is stored
+            return TAIL_CALL
+        return tail_call
+
+    def compile_expression(self, node):
+        kind = node.elem_type
+        if kind in (InterpreterBase.INT_NODE, InterpreterBase.STRING_NODE, InterpreterBase.BOOL_NODE):
+            value = node.get("val")
+            return lambda frame: value
+        if kind == InterpreterBase.NIL_NODE:
+            return lambda frame: None
+        if kind == InterpreterBase.VAR_NODE:
+            return self.compile_var(node)
+        if kind == InterpreterBase.FCALL_NODE:
+            return self.compile_call(node)
+        if kind in self.ARITH_OPS:
+            return self.compile_arithmetic(node)
+        if kind in self.COMPARE_OPS:
+            return self.compile_compare(node)
+        if kind in ("&&", "||"):
+            return self.compile_logical(node)
+        if kind == InterpreterBase.NEG_NODE:
+            return self.compile_neg(node)
+        if kind == InterpreterBase.NOT_NODE:
+            return self.compile_not(node)
+        if kind == InterpreterBase.NEW_NODE:
+            return self.compile_new(node)
+        error = self.interpreter.error
+        line = node.line
+
+        def unsupported(frame):
+            error(ErrorType.TYPE_ERROR, f"Unsupported expression {kind}", line)
+        return unsupported
+
+    def compile_var(self, node):
+        if node.resolve_error is not None:
+            return self.compile_resolve_error(node)
+        slot = node.slot
+        path = node.field_path
+        if path is not None:   # struct field
+            error = self.interpreter.error
+            line = node.line
+
+            def read_field(frame):
+                return path.get(frame[slot], error, line)
+            return read_field
+
+        def read(frame):
+            return frame[slot]
+        return read
+
+    def compile_new(self, node):
+        struct_type = self.interpreter.struct_types.get(node.get("var_type"))
+        if struct_type is None:   # reported when the expression runs
+            new_struct = self.interpreter.new_struct
+            type_name = node.get("var_type")
+            line = node.line
+            return lambda frame: new_struct(type_name, line)
+        new = struct_type.new
+        return lambda frame: new()
+
+    def compile_arithmetic(self, node):
+        op = node.elem_type
+        left = self.compile_expression(node.get("op1"))
+        right = self.compile_expression(node.get("op2"))
+        arithmetic = self.interpreter.arithmetic   # slow path, also reports the type errors
+        line = node.line
+
+        # fast paths for int operands, everything else goes to arithmetic()
+        if op == "+":
+            def add(frame):
+                value1 = left(frame)
+                value2 = right(frame)
+                if type(value1) is int and type(value2) is int:
+                    return value1 + value2
+                return arithmetic(op, value1, value2, line)
+            return add
+        if op == "-":
+            def sub(frame):
+                value1 = left(frame)
+                value2 = right(frame)
+                if type(value1) is int and type(value2) is int:
+                    return value1 - value2
+                return arithmetic(op, value1, value2, line)
+            return sub
+        if op == "*":
+            def mul(frame):
+                value1 = left(frame)
+                value2 = right(frame)
+                if type(value1) is int and type(value2) is int:
+                    return value1 * value2
+                return arithmetic(op, value1, value2, line)
+            return mul
+
+        def div(frame):
+            value1 = left(frame)
+            value2 = right(frame)
+            if type(value1) is int and type(value2) is int:
+                return value1 // value2
+            return arithmetic(op, value1, value2, line)
+        return div
+
+    def compile_compare(self, node):
+        op = node.elem_type
+        left = self.compile_expression(node.get("op1"))
+        right = self.compile_expression(node.get("op2"))
+        compare = self.interpreter.compare
+        line = node.line
+
+        if op == "<":
+            def less(frame):
+                value1 = left(frame)
+                value2 = right(frame)
+                if type(value1) is int and type(value2) is int:
+                    return value1 < value2
+                return compare(op, value1, value2, line)
+            return less
+        if op == "==":
+            def equal(frame):
+                value1 = left(frame)
+                value2 = right(frame)
+                if type(value1) is int and type(value2) is int:
+                    return value1 == value2
+                return compare(op, value1, value2, line)
+            return equal
+
+        def compare_values(frame):
+            return compare(op, left(frame), right(frame), line)
+        return compare_values
+
+    def compile_logical(self, node):
+        left = self.compile_expression(node.get("op1"))
+        right = self.compile_expression(node.get("op2"))
+        get_type = self.interpreter.get_type
+        error = self.interpreter.error
+        is_and = node.elem_type == "&&"
+        line = node.line
+
+        if self.interpreter.short_circuit:   # the right operand only runs when the left one doesn't decide
+            if is_and:
+                def logical_and(frame):
+                    value1 = left(frame)
+                    if value1 is False:
+                        return False
+                    if value1 is not True:
+                        error(ErrorType.TYPE_ERROR, "Incompatible types for logical operation: " + get_type(value1), line)
+                    value2 = right(frame)
+                    if type(value2) is not bool:
+                        error(ErrorType.TYPE_ERROR, "Incompatible types for logical operation: bool " + get_type(value2), line)
+                    return value2
+                return logical_and
+
+            def logical_or(frame):
+                value1 = left(frame)
+                if value1 is True:
+                    return True
+                if value1 is not False:
+                    error(ErrorType.TYPE_ERROR, "Incompatible types for logical operation: " + get_type(value1), line)
+                value2 = right(frame)
+                if type(value2) is not bool:
+                    error(ErrorType.TYPE_ERROR, "Incompatible types for logical operation: bool " + get_type(value2), line)
+                return value2
+            return logical_or
+
+        def logical(frame):   # strict evaluation
+            value1 = left(frame)
+            value2 = right(frame)
+            if type(value1) is not bool or type(value2) is not bool:
+                error(ErrorType.TYPE_ERROR, "Incompatible types for logical operation: " + get_type(value1) + " " + get_type(value2), line)
+            if is_and:
+                return value1 and value2
+            return value1 or value2
+        return logical
+
+    def compile_neg(self, node):
+        operand = self.compile_expression(node.get("op1"))
+        get_type = self.interpreter.get_type
+        error = self.interpreter.error
+        line = node.line
+
+        def neg(frame):
+            value = operand(frame)
+            if type(value) is not int:
+                error(ErrorType.TYPE_ERROR, "Incompatible types for int negation: " + get_type(value), line)
+            return -value
+        return neg
+
+    def compile_not(self, node):
+        operand = self.compile_expression(node.get("op1"))
+        get_type = self.interpreter.get_type
+        error = self.interpreter.error
+        line = node.line
+
+        def logical_not(frame):
+            value = operand(frame)
+            if type(value) is not bool:
+                error(ErrorType.TYPE_ERROR, "Incompatible types for logical negation: " + get_type(value), line)
+            return not value
+        return logical_not
+
+    def compile_call(self, node):
+        name = node.get("name")
+        args = tuple(self.compile_expression(arg) for arg in node.get("args"))
+        interpreter = self.interpreter
+        line = node.line
+
+        if name == "print":
+            def call_print(frame):
+                interpreter.do_print([arg(frame) for arg in args])
+            return call_print
+        if name == "inputi":
+            def call_inputi(frame):
+                return interpreter.do_inputi([arg(frame) for arg in args], line)
+            return call_inputi
+
+        func = self.functions.get((name, len(args)))
+        if func is None:
+            def undefined(frame):
+                interpreter.error(ErrorType.NAME_ERROR, f"Function {name} has not been defined", line)
+            return undefined
+
+        padding = [None] * (func.nslots - func.nparams)   # slots for the callee's own vars
+
+        def call(frame):
+            callee_frame = [arg(frame) for arg in args] + padding   # args are evaluated in the caller
+            result = func.body(callee_frame)
+            while result is TAIL_CALL:
+                result = func.body(callee_frame)
+            if result is None:   # no return statement, result is nil
+                return None
+            return result[0]
+
+        memo = interpreter.memo
+        if memo is None or (name, len(args)) not in interpreter.pure_functions:
+            return call
+        func_key = (name, len(args))
+        missing = MemoCache.MISSING
+
+        def memo_call(frame):
+            values = [arg(frame) for arg in args]
+            key = memo.key(func_key, values)
+            result = memo.get(key)
+            if result is missing:
+                callee_frame = values + padding
+                result = func.body(callee_frame)
+                while result is TAIL_CALL:
+                    result = func.body(callee_frame)
+                result = None if result is None else result[0]
+                memo.put(key, result)
+            return result
+        return memo_call
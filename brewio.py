@@ -0,0 +1,143 @@
+import sys
+from abc import ABC, abstractmethod
+from collections import deque
+
+# Output sinks for InterpreterBase.output(). By default the interpreter
+# prints every line and keeps all of them in output_log; pass one of these
+# as output_sink to stream or bound the output instead.
+#
+# Every sink has write(line), flush(), close() and lines() (what
+# get_output() returns for the run).
+
+
+class OutputSink(ABC):   # a subclass without write() can't be created
+    @abstractmethod
+    def write(self, line):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.flush()
+
+    def lines(self):   # lines kept by the sink, if any
+        return []
+
+
+class StreamSink(OutputSink):   # buffered writes to a text stream, nothing is kept in memory
+    def __init__(self, stream=None, batch_lines=1024):
+        self.stream = stream if stream is not None else sys.stdout
+        self.batch_lines = batch_lines
+        self.buffer = []
+
+    def write(self, line):
+        self.buffer.append(line)
+        if len(self.buffer) >= self.batch_lines:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.buffer.append("")   # join() adds the last newline
+            self.stream.write("\n".join(map(str, self.buffer)))
+            self.buffer = []
+        self.stream.flush()
+
+
+class FileSink(StreamSink):   # StreamSink over a file it opens and closes itself
+    def __init__(self, path, batch_lines=1024, encoding="utf-8"):
+        super().__init__(open(path, "w", encoding=encoding), batch_lines)
+
+    def close(self):
+        self.flush()
+        self.stream.close()
+
+
+class RingBufferSink(OutputSink):   # keeps only the last max_lines lines
+    def __init__(self, max_lines=1000):
+        self.buffer = deque(maxlen=max_lines)
+        self.total = 0   # lines written, including the ones dropped
+
+    def write(self, line):
+        self.buffer.append(line)
+        self.total += 1
+
+    def lines(self):
+        return list(self.buffer)
+
+
+class DiscardSink(OutputSink):   # drops everything, only counts the lines
+    def __init__(self):
+        self.total = 0
+
+    def write(self, line):
+        self.total += 1
+
+
+class CallbackSink(OutputSink):   # hands lines to callback(lines) in batches
+    def __init__(self, callback, batch_lines=1):
+        self.callback = callback
+        self.batch_lines = batch_lines
+        self.buffer = []
+
+    def write(self, line):
+        self.buffer.append(line)
+        if len(self.buffer) >= self.batch_lines:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            batch = self.buffer
+            self.buffer = []
+            self.callback(batch)
+
+
+# Input sources for InterpreterBase.get_input(). Pass one as inp instead of
+# a list to feed a program lazily, without building the whole list first.
+#
+# Every source has next_value() (the next line, or None when exhausted) and
+# next_int() (used by inputi, skips the str -> int round trip for sources
+# that already hold ints).
+
+
+class InputSource(ABC):   # a subclass without next_value() can't be created
+    @abstractmethod
+    def next_value(self):
+        pass
+
+    def next_int(self):
+        value = self.next_value()
+        if type(value) is int:
+            return value
+        return int(value)
+
+    def close(self):
+        pass
+
+
+class StreamSource(InputSource):   # one value per line of a text stream (stdin, a pipe, ...)
+    def __init__(self, stream=None):
+        self.lines = iter(stream if stream is not None else sys.stdin)   # io does the buffering
+
+    def next_value(self):
+        line = next(self.lines, None)
+        if line is None:
+            return None
+        return line.rstrip("\r\n")
+
+
+class FileSource(StreamSource):   # StreamSource over a file it opens with a large read buffer
+    def __init__(self, path, buffer_size=1 << 16, encoding="utf-8"):
+        self.file = open(path, "r", buffering=buffer_size, encoding=encoding)
+        super().__init__(self.file)
+
+    def close(self):
+        self.file.close()
+
+
+class IteratorSource(InputSource):   # values from any iterable or generator, ints are passed through
+    def __init__(self, values):
+        self.values = iter(values)
+
+    def next_value(self):
+        return next(self.values, None)
@@ -1,5 +1,6 @@
 
-from ply import lex
+import os
+import threading
 
 reserved = (
     "VAR",
@@ -130,7 +131,61 @@ def t_error(t):
     t.lexer.skip(1)
 
 def reset_lineno():
-    lexer.lineno = 1
-
-# Build the lexer
-lexer = lex.lex()
+    get_lexer().lineno = 1
+
+# Lexer/parser tables are generated once and loaded at startup without
+# validating the rules. Both are checked against the rules in the source
+# first (token regexes here, rule docstrings and precedence in brewparse)
+# and regenerated when they don't match. BREWIN_REBUILD_TABLES=1 forces a
+# rebuild.
+REBUILD_TABLES = os.environ.get("BREWIN_REBUILD_TABLES") == "1"
+LEXTAB = "brewlextab"
+
+def lextab_matches(lexobj):   # the table was generated from the token rules as they are now
+    rules = []   # (name, regex) of every rule, functions in the order they are defined
+    for name, value in globals().items():
+        if name.startswith("t_") and name not in ("t_ignore", "t_error"):
+            rules.append((name, value.__doc__ if callable(value) else value))
+    patterns = "".join(regex.pattern for regex, _ in lexobj.lexstatere["INITIAL"])
+    if patterns.count("(?P<t_") != len(rules):
+        return False
+    last = -1
+    for name, regex in rules:
+        position = patterns.find(f"(?P<{name}>{regex})")
+        if position < 0:
+            return False
+        if callable(globals()[name]):   # function rules are tried in definition order
+            if position < last:
+                return False
+            last = position
+    return (lexobj.lextokens == set(tokens) and lexobj.lexliterals == "".join(literals)
+            and lexobj.lexstateignore["INITIAL"] == t_ignore)
+
+def build_lexer(rebuild=REBUILD_TABLES):
+    from ply import lex   # ply (and the modules it pulls in) only loads once a lexer is needed
+
+    if not rebuild:
+        try:
+            lexobj = lex.Lexer()
+            lexobj.lexoptimize = True
+            lexobj.readtab(LEXTAB, globals())
+            if lextab_matches(lexobj):
+                return lexobj
+        except (ImportError, KeyError):   # missing table or a rule function that's gone
+            pass
+    lexobj = lex.lex()   # validates the rules
+    lexobj.writetab(LEXTAB, os.path.dirname(os.path.abspath(__file__)))
+    return lexobj
+
+# The lexer is built on first use, importing this module does no work.
+# brewparse.Parser clones it, so every parser has its own lexer state.
+lexer = None
+lexer_lock = threading.Lock()
+
+def get_lexer():
+    global lexer
+    if lexer is None:
+        with lexer_lock:   # only one thread builds it
+            if lexer is None:
+                lexer = build_lexer()
+    return lexer
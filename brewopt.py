@@ -0,0 +1,190 @@
+from element import (Program, Func, Arg, VarDef, Assign, If, For, Return, Try, Catch, Raise,
+                     BinOp, UnaryOp, Value, Nil, FCall)
+from intbase import InterpreterBase
+
+# Optimizer pass over the AST from brewparse:
+#   - operators whose operands are all literals are folded into a literal
+#   - if statements on a constant condition keep only the branch that runs
+#   - for loops whose condition is constant false keep only their init
+#
+# Only operations that would succeed at run time are folded, anything that
+# would raise (TYPE_ERROR, division by zero) is left in place so the error
+# still happens when, and only if, the statement runs. With short circuit
+# evaluation (the interpreter's default), false && x and true || x fold to
+# their left side whatever x is, since x never runs.
+#
+# The pass builds a new tree and never changes the one it's given, since
+# ASTs can be shared between runs through brewcache.
+
+
+class Optimizer:
+    ARITH_OPS = {"+", "-", "*", "/"}
+    COMPARE_OPS = {"==", "!=", "<", "<=", ">", ">="}
+    LITERALS = {InterpreterBase.INT_NODE, InterpreterBase.STRING_NODE, InterpreterBase.BOOL_NODE, InterpreterBase.NIL_NODE}
+
+    def __init__(self, short_circuit=True):
+        self.short_circuit = short_circuit   # must match the interpreter's, it decides whether x runs in false && x
+        self.folded = 0   # expressions replaced by a literal
+        self.pruned = 0   # if/for statements simplified
+
+    def optimize_program(self, ast):
+        functions = [self.optimize_function(f) for f in ast.functions]
+        return Program(structs=ast.structs, functions=functions, line=ast.line, col=ast.col)
+
+    def optimize_function(self, node):
+        args = [Arg(name=arg.name, var_type=arg.var_type, line=arg.line, col=arg.col) for arg in node.args]
+        return Func(name=node.name, args=args, return_type=node.return_type,
+                    statements=self.optimize_block(node.statements), line=node.line, col=node.col)
+
+    def optimize_block(self, statements):
+        if statements is None:
+            return None
+        result = []
+        for statement in statements:
+            result.extend(self.optimize_statement(statement))   # a statement can turn into 0..n statements
+        return result
+
+    # returns the list of statements that replace node
+    def optimize_statement(self, node):
+        kind = node.elem_type
+        if kind == InterpreterBase.VAR_DEF_NODE:
+            return [VarDef(name=node.name, var_type=node.var_type, line=node.line, col=node.col)]
+        if kind == "=":
+            return [Assign(name=node.name, expression=self.optimize_expression(node.expression),
+                           line=node.line, col=node.col)]
+        if kind == InterpreterBase.RETURN_NODE:
+            expression = node.expression
+            return [Return(expression=None if expression is None else self.optimize_expression(expression),
+                           line=node.line, col=node.col)]
+        if kind == InterpreterBase.IF_NODE:
+            return self.optimize_if(node)
+        if kind == InterpreterBase.FOR_NODE:
+            return self.optimize_for(node)
+        if kind == InterpreterBase.TRY_NODE:
+            catchers = [Catch(exception_type=c.exception_type, statements=self.optimize_block(c.statements),
+                              line=c.line, col=c.col)
+                        for c in node.catchers]
+            return [Try(statements=self.optimize_block(node.statements), catchers=catchers,
+                        line=node.line, col=node.col)]
+        if kind == InterpreterBase.RAISE_NODE:
+            return [Raise(exception_type=self.optimize_expression(node.exception_type), line=node.line, col=node.col)]
+        return [self.optimize_expression(node)]   # expression statement
+
+    def optimize_if(self, node):
+        condition = self.optimize_expression(node.condition)
+        statements = self.optimize_block(node.statements)
+        else_statements = self.optimize_block(node.else_statements)
+        if condition.elem_type != InterpreterBase.BOOL_NODE:   # not constant, or a type error at run time
+            return [If(condition=condition, statements=statements, else_statements=else_statements,
+                       line=node.line, col=node.col)]
+        self.pruned += 1
+        taken = statements if condition.val else else_statements
+        if not taken:
+            return []
+        if any(s.elem_type == InterpreterBase.VAR_DEF_NODE for s in taken):   # the block needs its own scope
+            always = self.at(self.literal(True), condition)   # taken may be the else block, so not condition
+            return [If(condition=always, statements=taken, else_statements=None, line=node.line, col=node.col)]
+        return taken
+
+    def optimize_for(self, node):
+        init = self.optimize_statement(node.init)[0]
+        condition = self.optimize_expression(node.condition)
+        if condition.elem_type == InterpreterBase.BOOL_NODE and not condition.val:
+            self.pruned += 1
+            return [init]   # the body and update never run
+        update = self.optimize_statement(node.update)[0]
+        return [For(init=init, condition=condition, update=update, statements=self.optimize_block(node.statements),
+                    line=node.line, col=node.col)]
+
+    def optimize_expression(self, node):
+        kind = node.elem_type
+        if kind in self.ARITH_OPS or kind in self.COMPARE_OPS or kind in ("&&", "||"):
+            op1 = self.optimize_expression(node.op1)
+            op2 = self.optimize_expression(node.op2)
+            if (self.short_circuit and kind in ("&&", "||") and op1.elem_type == InterpreterBase.BOOL_NODE
+                    and op1.val == (kind == "||")):   # the left side decides, op2 never runs
+                self.folded += 1
+                return self.at(self.literal(op1.val), node)
+            if op1.elem_type in self.LITERALS and op2.elem_type in self.LITERALS:
+                folded = self.fold_binary(kind, op1, op2)
+                if folded is not None:
+                    self.folded += 1
+                    return self.at(folded, node)
+            return BinOp(kind, op1=op1, op2=op2, line=node.line, col=node.col)
+        if kind in (InterpreterBase.NEG_NODE, InterpreterBase.NOT_NODE):
+            op1 = self.optimize_expression(node.op1)
+            if kind == InterpreterBase.NEG_NODE and op1.elem_type == InterpreterBase.INT_NODE:
+                self.folded += 1
+                return Value(InterpreterBase.INT_NODE, val=-op1.val, line=node.line, col=node.col)
+            if kind == InterpreterBase.NOT_NODE and op1.elem_type == InterpreterBase.BOOL_NODE:
+                self.folded += 1
+                return Value(InterpreterBase.BOOL_NODE, val=not op1.val, line=node.line, col=node.col)
+            return UnaryOp(kind, op1=op1, line=node.line, col=node.col)
+        if kind == InterpreterBase.FCALL_NODE:
+            return FCall(name=node.name, args=[self.optimize_expression(arg) for arg in node.args],
+                         line=node.line, col=node.col)
+        return node   # literals, vars and nodes this pass doesn't know about
+
+    def at(self, new_node, node):   # new_node takes the source position of the node it replaces
+        new_node.line = node.line
+        new_node.col = node.col
+        return new_node
+
+    def literal_value(self, node):
+        if node.elem_type == InterpreterBase.NIL_NODE:
+            return None
+        return node.val
+
+    def literal(self, value):
+        if value is None:
+            return Nil()
+        if isinstance(value, bool):
+            return Value(InterpreterBase.BOOL_NODE, val=value)
+        if isinstance(value, int):
+            return Value(InterpreterBase.INT_NODE, val=value)
+        return Value(InterpreterBase.STRING_NODE, val=value)
+
+    # the literal op1 <op> op2 evaluates to, or None when it must be left to run time
+    def fold_binary(self, op, op1, op2):
+        type1 = op1.elem_type
+        type2 = op2.elem_type
+        value1 = self.literal_value(op1)
+        value2 = self.literal_value(op2)
+        if op in self.ARITH_OPS:
+            if type1 == type2 == InterpreterBase.INT_NODE:
+                if op == "+":
+                    return self.literal(value1 + value2)
+                if op == "-":
+                    return self.literal(value1 - value2)
+                if op == "*":
+                    return self.literal(value1 * value2)
+                if value2 != 0:
+                    return self.literal(value1 // value2)
+            elif op == "+" and type1 == type2 == InterpreterBase.STRING_NODE:
+                return self.literal(value1 + value2)
+            return None
+        if op in self.COMPARE_OPS:
+            if type1 != type2:   # mixed types: only == and != are defined
+                if op == "==":
+                    return self.literal(False)
+                if op == "!=":
+                    return self.literal(True)
+                return None
+            if op == "==":
+                return self.literal(value1 == value2)
+            if op == "!=":
+                return self.literal(value1 != value2)
+            if type1 not in (InterpreterBase.INT_NODE, InterpreterBase.STRING_NODE):
+                return None
+            if op == "<":
+                return self.literal(value1 < value2)
+            if op == "<=":
+                return self.literal(value1 <= value2)
+            if op == ">":
+                return self.literal(value1 > value2)
+            return self.literal(value1 >= value2)
+        if type1 == type2 == InterpreterBase.BOOL_NODE:   # && and ||
+            if op == "&&":
+                return self.literal(value1 and value2)
+            return self.literal(value1 or value2)
+        return None
@@ -1,7 +1,10 @@
-from element import Element
+import copy
+import threading
+
+from element import (Program, Struct, FieldDef, Func, Arg, VarDef, Assign, If, For,
+                     Return, Try, Catch, Raise, BinOp, UnaryOp, New, Value, Nil, Var, FCall)
 from brewlex import *
 from intbase import InterpreterBase
-from ply import yacc
 
 # Parsing rules
 
@@ -14,6 +17,10 @@ precedence = (
     ("right", "UMINUS", "NOT"),
 )
 
+def position(p, n):   # (line, column) where symbol n of the rule starts, both from 1
+    lexpos = p.lexpos(n)
+    return p.lineno(n), lexpos - p.lexer.lexdata.rfind("\n", 0, lexpos)
+
 def collapse_items(p, group_index, singleton_index):
     if len(p) == 2:
         p[0] = [p[1]]
@@ -26,9 +33,9 @@ def p_program(p):
     """program : structs funcs
     | funcs"""
     if len(p) == 2:
-        p[0] = Element(InterpreterBase.PROGRAM_NODE, structs=[], functions=p[1])
+        p[0] = Program(structs=[], functions=p[1], line=1, col=1)
     else:
-        p[0] = Element(InterpreterBase.PROGRAM_NODE, structs=p[1], functions=p[2])
+        p[0] = Program(structs=p[1], functions=p[2], line=1, col=1)
 
 def p_structs(p):
     """structs : structs struct
@@ -37,7 +44,8 @@ def p_structs(p):
 
 def p_struct(p):
    "struct : STRUCT NAME LBRACE fields RBRACE"
-   p[0] = Element(InterpreterBase.STRUCT_NODE, name=p[2], fields=p[4])
+   line, col = position(p, 1)
+   p[0] = Struct(name=p[2], fields=p[4], line=line, col=col)
 
 def p_fields(p):
    """fields : fields field
@@ -46,7 +54,8 @@ def p_fields(p):
 
 def p_field(p):
   "field : NAME COLON NAME SEMI"  # field_name: type
-  p[0] = Element(InterpreterBase.FIELD_DEF_NODE, name=p[1], var_type=p[3])
+  line, col = position(p, 1)
+  p[0] = FieldDef(name=p[1], var_type=p[3], line=line, col=col)
 
 def p_funcs(p):
     """funcs : funcs func
@@ -57,18 +66,20 @@ def p_funcs(p):
 def p_func(p):
     """func : FUNC NAME LPAREN formal_args RPAREN COLON NAME LBRACE statements RBRACE
     | FUNC NAME LPAREN RPAREN COLON NAME LBRACE statements RBRACE"""
+    line, col = position(p, 1)
     if len(p) == 11:  # handle with 1+ formal args
-        p[0] = Element(InterpreterBase.FUNC_NODE, name=p[2], args=p[4], return_type = p[7], statements=p[9])
+        p[0] = Func(name=p[2], args=p[4], return_type = p[7], statements=p[9], line=line, col=col)
     else:  # handle no formal args
-        p[0] = Element(InterpreterBase.FUNC_NODE, name=p[2], args=[], return_type = p[6], statements=p[8])
+        p[0] = Func(name=p[2], args=[], return_type = p[6], statements=p[8], line=line, col=col)
 
 def p_func2(p):
     """func : FUNC NAME LPAREN formal_args RPAREN LBRACE statements RBRACE
     | FUNC NAME LPAREN RPAREN LBRACE statements RBRACE"""
+    line, col = position(p, 1)
     if len(p) == 9:  # handle with 1+ formal args
-        p[0] = Element(InterpreterBase.FUNC_NODE, name=p[2], args=p[4], return_type = None, statements=p[7])
+        p[0] = Func(name=p[2], args=p[4], return_type = None, statements=p[7], line=line, col=col)
     else:  # handle no formal args
-        p[0] = Element(InterpreterBase.FUNC_NODE, name=p[2], args=[], return_type = None, statements=p[6])
+        p[0] = Func(name=p[2], args=[], return_type = None, statements=p[6], line=line, col=col)
 
 def p_formal_args(p):
     """formal_args : formal_args COMMA formal_arg
@@ -79,10 +90,11 @@ def p_formal_args(p):
 def p_formal_arg(p):
     """formal_arg : NAME COLON NAME
     | NAME"""
+    line, col = position(p, 1)
     if len(p) == 2:
-      p[0] = Element(InterpreterBase.ARG_NODE, name=p[1], var_type = None)
+      p[0] = Arg(name=p[1], var_type = None, line=line, col=col)
     else:
-      p[0] = Element(InterpreterBase.ARG_NODE, name=p[1], var_type = p[3])
+      p[0] = Arg(name=p[1], var_type = p[3], line=line, col=col)
 
 def p_statements(p):
     """statements : statements statement
@@ -96,15 +108,17 @@ def p_statement___assign(p):
 
 def p_assign(p):
     "assign : variable_w_dot ASSIGN expression"
-    p[0] = Element("=", name=p[1], expression=p[3])
+    line, col = position(p, 1)
+    p[0] = Assign(name=p[1], expression=p[3], line=line, col=col)
 
 def p_statement___var(p):
     """statement : VAR variable COLON NAME SEMI
     | VAR variable SEMI"""
+    line, col = position(p, 1)
     if len(p) == 6:
-      p[0] = Element(InterpreterBase.VAR_DEF_NODE, name=p[2], var_type=p[4])
+      p[0] = VarDef(name=p[2], var_type=p[4], line=line, col=col)
     else:
-      p[0] = Element(InterpreterBase.VAR_DEF_NODE, name=p[2], var_type=None)
+      p[0] = VarDef(name=p[2], var_type=None, line=line, col=col)
 
 def p_variable(p):
     "variable : NAME"
@@ -117,29 +131,35 @@ def p_variable_w_dot(p):
         p[0] = p[1] + "." + p[3]
     else:
         p[0] = p[1]
+    p.set_lineno(0, p.lineno(1))  # assignments and variables start where their first NAME does
+    p.set_lexpos(0, p.lexpos(1))
 
 def p_statement_if(p):
     """statement : IF LPAREN expression RPAREN LBRACE statements RBRACE
     | IF LPAREN expression RPAREN LBRACE statements RBRACE ELSE LBRACE statements RBRACE
     """
+    line, col = position(p, 1)
     if len(p) == 8:
-        p[0] = Element(
-            InterpreterBase.IF_NODE,
+        p[0] = If(
             condition=p[3],
             statements=p[6],
             else_statements=None,
+            line=line,
+            col=col,
         )
     else:
-        p[0] = Element(
-            InterpreterBase.IF_NODE,
+        p[0] = If(
             condition=p[3],
             statements=p[6],
             else_statements=p[10],
+            line=line,
+            col=col,
         )
 
 def p_statement_try(p):
     """statement : TRY LBRACE statements RBRACE catchers"""
-    p[0] = Element(InterpreterBase.TRY_NODE, statements=p[3], catchers=p[5])
+    line, col = position(p, 1)
+    p[0] = Try(statements=p[3], catchers=p[5], line=line, col=col)
 
 def p_catches(p):
     """catchers : catchers catch
@@ -148,15 +168,18 @@ def p_catches(p):
 
 def p_catch(p):
     "catch : CATCH STRING LBRACE statements RBRACE"
-    p[0] = Element(InterpreterBase.CATCH_NODE, exception_type=p[2], statements=p[4])
+    line, col = position(p, 1)
+    p[0] = Catch(exception_type=p[2], statements=p[4], line=line, col=col)
 
 def p_statement_for(p):
     "statement : FOR LPAREN assign SEMI expression SEMI assign RPAREN LBRACE statements RBRACE"
-    p[0] = Element(InterpreterBase.FOR_NODE, init=p[3], condition=p[5], update=p[7], statements=p[10])
+    line, col = position(p, 1)
+    p[0] = For(init=p[3], condition=p[5], update=p[7], statements=p[10], line=line, col=col)
 
 def p_statement_raise(p):
     "statement : RAISE expression SEMI"
-    p[0] = Element(InterpreterBase.RAISE_NODE, exception_type=p[2])
+    line, col = position(p, 1)
+    p[0] = Raise(exception_type=p[2], line=line, col=col)
 
 def p_statement_expr(p):
     "statement : expression SEMI"
@@ -170,21 +193,25 @@ def p_statement_return(p):
         expr = p[2]
     else:
         expr = None
-    p[0] = Element(InterpreterBase.RETURN_NODE, expression=expr)
+    line, col = position(p, 1)
+    p[0] = Return(expression=expr, line=line, col=col)
 
 
 def p_expression_not(p):
     "expression : NOT expression"
-    p[0] = Element(InterpreterBase.NOT_NODE, op1=p[2])
+    line, col = position(p, 1)
+    p[0] = UnaryOp(InterpreterBase.NOT_NODE, op1=p[2], line=line, col=col)
 
 
 def p_expression_uminus(p):
     "expression : MINUS expression %prec UMINUS"
-    p[0] = Element(InterpreterBase.NEG_NODE, op1=p[2])
+    line, col = position(p, 1)
+    p[0] = UnaryOp(InterpreterBase.NEG_NODE, op1=p[2], line=line, col=col)
 
 def p_expression_new(p):
     "expression : NEW NAME"
-    p[0] = Element(InterpreterBase.NEW_NODE, var_type=p[2])
+    line, col = position(p, 1)
+    p[0] = New(var_type=p[2], line=line, col=col)
 
 
 def p_arith_expression_binop(p):
@@ -198,7 +225,7 @@ def p_arith_expression_binop(p):
     | expression MINUS expression
     | expression MULTIPLY expression
     | expression DIVIDE expression"""
-    p[0] = Element(p[2], op1=p[1], op2=p[3])
+    p[0] = BinOp(p[2], op1=p[1], op2=p[3], line=p[1].line, col=p[1].col)
 
 
 def p_expression_group(p):
@@ -209,43 +236,49 @@ def p_expression_group(p):
 def p_expression_and_or(p):
     """expression : expression OR expression
     | expression AND expression"""
-    p[0] = Element(p[2], op1=p[1], op2=p[3])
+    p[0] = BinOp(p[2], op1=p[1], op2=p[3], line=p[1].line, col=p[1].col)
 
 
 def p_expression_number(p):
     "expression : NUMBER"
-    p[0] = Element(InterpreterBase.INT_NODE, val=p[1])
+    line, col = position(p, 1)
+    p[0] = Value(InterpreterBase.INT_NODE, val=p[1], line=line, col=col)
 
 
 def p_expression_bool(p):
     """expression : TRUE
     | FALSE"""
     bool_val = p[1] == InterpreterBase.TRUE_DEF
-    p[0] = Element(InterpreterBase.BOOL_NODE, val=bool_val)
+    line, col = position(p, 1)
+    p[0] = Value(InterpreterBase.BOOL_NODE, val=bool_val, line=line, col=col)
 
 
 def p_expression_nil(p):
     "expression : NIL"
-    p[0] = Element(InterpreterBase.NIL_NODE)
+    line, col = position(p, 1)
+    p[0] = Nil(line=line, col=col)
 
 
 def p_expression_string(p):
     "expression : STRING"
-    p[0] = Element(InterpreterBase.STRING_NODE, val=p[1])
+    line, col = position(p, 1)
+    p[0] = Value(InterpreterBase.STRING_NODE, val=p[1], line=line, col=col)
 
 
 def p_expression_variable(p):
     "expression : variable_w_dot"
-    p[0] = Element(InterpreterBase.VAR_NODE, name=p[1])
+    line, col = position(p, 1)
+    p[0] = Var(name=p[1], line=line, col=col)
 
 
 def p_func_call(p):
     """expression : NAME LPAREN args RPAREN
     | NAME LPAREN RPAREN"""
+    line, col = position(p, 1)
     if len(p) == 5:
-        p[0] = Element(InterpreterBase.FCALL_NODE, name=p[1], args=p[3])
+        p[0] = FCall(name=p[1], args=p[3], line=line, col=col)
     else:
-        p[0] = Element(InterpreterBase.FCALL_NODE, name=p[1], args=[])
+        p[0] = FCall(name=p[1], args=[], line=line, col=col)
 
 
 def p_expression_args(p):
@@ -261,14 +294,70 @@ def p_error(p):
         print("Syntax error at EOF")
 
 
-# exported function
-def parse_program(program):
-    reset_lineno()
-    ast = yacc.parse(program)
-    if ast is None:
-        raise SyntaxError("Syntax error")
-    return ast
 
 
-# generate our parser
-yacc.yacc() # yacc.yacc(debug=True, debuglog=open("parse.log", "w"))
+def load_parser():   # LR tables straight from parsetab.py, without validating the grammar
+    from ply import yacc
+
+    lr = yacc.LRTable()
+    signature = lr.read_table("parsetab")
+    grammar = yacc.ParserReflect(globals())   # only collects the rules, well under a millisecond
+    grammar.get_all()
+    if signature != grammar.signature():   # a rule docstring, the precedence or the tokens changed
+        raise yacc.VersionError("parsetab.py is out of date")
+    lr.bind_callables(globals())
+    return yacc.LRParser(lr, p_error)
+
+def build_parser():   # checks the grammar against parsetab.py and regenerates it if it changed
+    from ply import yacc
+
+    return yacc.yacc(debug=False) # yacc.yacc(debug=True, debuglog=open("parse.log", "w"))
+
+def make_parser(rebuild=REBUILD_TABLES):
+    from ply import yacc
+
+    if not rebuild:
+        try:
+            return load_parser()
+        except (ImportError, yacc.VersionError, KeyError):   # missing/outdated table or a renamed rule
+            pass
+    return build_parser()
+
+
+# the parser is generated on first use, importing this module does no work
+parser = None
+parser_lock = threading.Lock()
+
+def get_parser():   # the shared LR parser, Parser instances copy it
+    global parser
+    if parser is None:
+        with parser_lock:   # only one thread builds it
+            if parser is None:
+                parser = make_parser()
+    return parser
+
+
+# A lexer and an LR parser of its own, so any number of Parsers can parse at
+# the same time (one per thread). Only the grammar tables are shared, and
+# nothing writes to them while parsing.
+class Parser:
+    def __init__(self):
+        self.lexer = get_lexer().clone()
+        self.parser = copy.copy(get_parser())   # parse() keeps its stacks on the copy
+
+    def parse(self, program):
+        self.lexer.lineno = 1
+        ast = self.parser.parse(program, lexer=self.lexer)
+        if ast is None:
+            raise SyntaxError("Syntax error")
+        return ast
+
+
+thread_parsers = threading.local()   # parse_program keeps one Parser per thread
+
+# exported function
+def parse_program(program):
+    parser = getattr(thread_parsers, "parser", None)
+    if parser is None:
+        parser = thread_parsers.parser = Parser()
+    return parser.parse(program)
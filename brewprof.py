@@ -0,0 +1,125 @@
+import marshal
+import time
+
+# Profiler for Interpreter(profiler=Profiler()), supported by the tree and
+# closure engines. Records, for every Brewin function:
+#   - calls, and primitive calls (the ones that weren't recursive)
+#   - exclusive time, spent in the function itself
+#   - inclusive time, including its callees (recursive calls counted once)
+# plus how many statements ran on each source line, and the exclusive time
+# of every distinct call stack for flame graphs.
+#
+# Functions are identified by (name, line of the func keyword). A self tail
+# call or a memoized result doesn't count as a new call.
+
+
+class FunctionStats:
+    __slots__ = ("calls", "primitive_calls", "exclusive", "inclusive", "callers")
+
+    def __init__(self):
+        self.calls = 0
+        self.primitive_calls = 0
+        self.exclusive = 0.0
+        self.inclusive = 0.0
+        self.callers = {}   # caller (name, line) -> [calls, primitive calls, exclusive, inclusive]
+
+
+class Profiler:
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.functions = {}   # (name, line) -> FunctionStats
+        self.line_counts = {}   # line -> statements executed on it
+        self.frames = []   # [function, start time, time spent in callees, stack id] of every active call
+        self.active = {}   # function -> how many of its calls are active
+        self.stack_index = {}   # (parent stack id, function) -> stack id
+        self.stack_parents = []   # stack id -> parent stack id (None for the outermost call)
+        self.stack_functions = []   # stack id -> function
+        self.stack_times = []   # stack id -> exclusive time
+
+    def count_line(self, line):
+        self.line_counts[line] = self.line_counts.get(line, 0) + 1
+
+    def enter(self, name, line):
+        function = (name, line)
+        parent = self.frames[-1][3] if self.frames else None
+        stack_id = self.stack_index.get((parent, function))
+        if stack_id is None:
+            stack_id = len(self.stack_parents)
+            self.stack_index[(parent, function)] = stack_id
+            self.stack_parents.append(parent)
+            self.stack_functions.append(function)
+            self.stack_times.append(0.0)
+        self.active[function] = self.active.get(function, 0) + 1
+        self.frames.append([function, self.clock(), 0.0, stack_id])
+
+    def exit(self):
+        function, start, callee_time, stack_id = self.frames.pop()
+        elapsed = self.clock() - start
+        exclusive = elapsed - callee_time
+        self.stack_times[stack_id] += exclusive
+        self.active[function] -= 1
+        primitive = self.active[function] == 0
+
+        stats = self.functions.get(function)
+        if stats is None:
+            stats = self.functions[function] = FunctionStats()
+        stats.calls += 1
+        stats.exclusive += exclusive
+        if primitive:
+            stats.primitive_calls += 1
+            stats.inclusive += elapsed
+
+        caller = None
+        if self.frames:
+            self.frames[-1][2] += elapsed
+            caller = self.frames[-1][0]
+        edge = stats.callers.get(caller)
+        if edge is None:
+            edge = stats.callers[caller] = [0, 0, 0.0, 0.0]
+        edge[0] += 1
+        edge[2] += exclusive
+        if primitive:
+            edge[1] += 1
+            edge[3] += elapsed
+
+    # text report, functions sorted by sort ("exclusive", "inclusive" or "calls"), then the busiest lines
+    def report(self, sort="exclusive", limit=20):
+        lines = [f"{'calls':>10} {'primitive':>10} {'exclusive':>12} {'inclusive':>12}  function"]
+        rows = sorted(self.functions.items(), key=lambda item: getattr(item[1], sort), reverse=True)
+        for (name, line), stats in rows[:limit]:
+            lines.append(f"{stats.calls:>10} {stats.primitive_calls:>10} {stats.exclusive:>12.6f} "
+                         f"{stats.inclusive:>12.6f}  {name} (line {line})")
+        lines.append("")
+        lines.append(f"{'count':>10}  line")
+        busiest = sorted(self.line_counts.items(), key=lambda item: item[1], reverse=True)
+        for line, count in busiest[:limit]:
+            lines.append(f"{count:>10}  {line}")
+        return "\n".join(lines)
+
+    # file that python's pstats module (and tools like snakeviz) can load
+    def dump_pstats(self, path, filename="<brewin>"):
+        def label(function):
+            name, line = function
+            return (filename, line or 0, name)
+
+        stats = {}
+        for function, function_stats in self.functions.items():
+            callers = {}
+            for caller, (calls, primitive_calls, exclusive, inclusive) in function_stats.callers.items():
+                if caller is not None:
+                    callers[label(caller)] = (primitive_calls, calls, exclusive, inclusive)
+            stats[label(function)] = (function_stats.primitive_calls, function_stats.calls,
+                                      function_stats.exclusive, function_stats.inclusive, callers)
+        with open(path, "wb") as f:
+            marshal.dump(stats, f)
+
+    # one "outer;inner;... microseconds" line per call stack, the input format of flamegraph.pl
+    def dump_collapsed(self, path):
+        with open(path, "w") as f:
+            for stack_id, seconds in enumerate(self.stack_times):
+                names = []
+                parent = stack_id
+                while parent is not None:
+                    names.append(self.stack_functions[parent][0])
+                    parent = self.stack_parents[parent]
+                f.write(";".join(reversed(names)) + f" {int(seconds * 1000000)}\n")
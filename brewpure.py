@@ -0,0 +1,124 @@
+from collections import OrderedDict
+
+from intbase import InterpreterBase
+
+# Purity analysis and the memo cache used by Interpreter(memoize=True).
+#
+# A function is pure when running it can't be told apart from looking its
+# result up: it doesn't print, doesn't read input, and only calls pure
+# functions. Brewin has no globals, so a pure function only sees its args.
+# Anything the analysis doesn't know about (structs, try/raise, calls to
+# undefined functions) makes a function impure.
+
+
+class PurityAnalyzer:
+    IO_FUNCTIONS = {"print", "inputi"}
+    EXPRESSION_KINDS = {"+", "-", "*", "/", "==", "!=", "<", "<=", ">", ">=", "&&", "||",
+                        InterpreterBase.NEG_NODE, InterpreterBase.NOT_NODE}
+    LITERALS = {InterpreterBase.INT_NODE, InterpreterBase.STRING_NODE, InterpreterBase.BOOL_NODE, InterpreterBase.NIL_NODE}
+
+    def __init__(self):
+        self.calls = {}   # (name, arity) -> set of (name, arity) it calls
+        self.impure = set()
+
+    # returns the set of (name, arity) of the pure functions in the program
+    def analyze_program(self, ast):
+        functions = {}
+        for function_node in ast.functions:
+            functions[(function_node.name, len(function_node.args))] = function_node   # a later duplicate definition wins
+        for func_key, function_node in functions.items():
+            self.func_key = func_key
+            self.calls[func_key] = set()
+            self.check_block(function_node.statements)
+
+        changed = True
+        while changed:   # impure callees make their callers impure
+            changed = False
+            for func_key, callees in self.calls.items():
+                if func_key in self.impure:
+                    continue
+                if any(callee in self.impure or callee not in functions for callee in callees):
+                    self.impure.add(func_key)
+                    changed = True
+        return {func_key for func_key in functions if func_key not in self.impure}
+
+    def check_block(self, statements):
+        for statement in statements or []:
+            self.check_statement(statement)
+
+    def check_statement(self, node):
+        kind = node.elem_type
+        if kind == InterpreterBase.VAR_DEF_NODE:
+            return
+        if kind == "=":
+            self.check_name(node.name)
+            self.check_expression(node.expression)
+        elif kind == InterpreterBase.IF_NODE:
+            self.check_expression(node.condition)
+            self.check_block(node.statements)
+            self.check_block(node.else_statements)
+        elif kind == InterpreterBase.FOR_NODE:
+            self.check_statement(node.init)
+            self.check_expression(node.condition)
+            self.check_statement(node.update)
+            self.check_block(node.statements)
+        elif kind == InterpreterBase.RETURN_NODE:
+            if node.expression is not None:
+                self.check_expression(node.expression)
+        elif kind == InterpreterBase.FCALL_NODE:
+            self.check_expression(node)
+        else:
+            self.impure.add(self.func_key)
+
+    def check_name(self, name):   # dotted names are struct fields, which live outside the frame
+        if "." in name:
+            self.impure.add(self.func_key)
+
+    def check_expression(self, node):
+        kind = node.elem_type
+        if kind in self.LITERALS:
+            return
+        if kind == InterpreterBase.VAR_NODE:
+            self.check_name(node.name)
+        elif kind == InterpreterBase.FCALL_NODE:
+            if node.name in self.IO_FUNCTIONS:
+                self.impure.add(self.func_key)
+            self.calls[self.func_key].add((node.name, len(node.args)))
+            for arg in node.args:
+                self.check_expression(arg)
+        elif kind in self.EXPRESSION_KINDS:
+            self.check_expression(node.op1)
+            if kind not in (InterpreterBase.NEG_NODE, InterpreterBase.NOT_NODE):
+                self.check_expression(node.op2)
+        else:
+            self.impure.add(self.func_key)
+
+
+class MemoCache:   # results of pure function calls, least recently used entries are dropped first
+    MISSING = object()   # get() result when there is no entry, nil results are cached as None
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, func_key, values):   # the type is part of the key so 1 and true stay apart
+        return (func_key, tuple((type(value), value) for value in values))
+
+    def get(self, key):
+        result = self.entries.get(key, self.MISSING)
+        if result is self.MISSING:
+            self.misses += 1
+        else:
+            self.entries.move_to_end(key)
+            self.hits += 1
+        return result
+
+    def put(self, key, result):
+        self.entries[key] = result
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self.entries)}
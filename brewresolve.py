@@ -0,0 +1,115 @@
+from intbase import ErrorType, InterpreterBase
+
+# Static resolver: walks every function once and gives each formal arg and
+# vardef a flat index into the function's frame (a python list), so engines
+# can read and write variables with frame[slot] no matter how deeply blocks
+# are nested.
+#
+# Results are stored on the AST nodes themselves:
+#   func            .nslots           size of the frame
+#   arg, vardef     .slot             index in the frame
+#   var, =          .slot             index of the variable it refers to (of a
+#                                     for a dotted name like a.b.c)
+#   vardef, var, =  .resolve_error    (error_type, description) if the name
+#                                     is undefined / defined twice
+# Engines raise resolve_error when the node is executed, so output printed
+# before the bad statement still shows up like it does in the tree walker.
+
+
+class Resolver:
+    def __init__(self):
+        self.scopes = []   # block scopes of the current function, name -> slot
+        self.next_slot = 0
+        self.nslots = 0
+
+    def resolve_program(self, ast):
+        for function_node in ast.get("functions"):
+            self.resolve_function(function_node)
+
+    def resolve_function(self, function_node):
+        self.scopes = [{}]   # the body shares the scope of the args
+        self.next_slot = 0
+        self.nslots = 0
+        for arg in function_node.get("args"):
+            arg.slot = self.declare(arg)
+        function_node.resolve_error = None
+        for arg in function_node.get("args"):
+            if arg.resolve_error is not None:   # duplicate formal arg, raised when called
+                function_node.resolve_error = arg.resolve_error
+        self.resolve_statements(function_node.get("statements"))
+        function_node.nslots = self.nslots
+
+    def resolve_block(self, statements):   # statements in a new block scope
+        self.scopes.append({})
+        block_start = self.next_slot
+        self.resolve_statements(statements)
+        self.scopes.pop()
+        self.next_slot = block_start   # slots of a finished block can be reused
+
+    def resolve_statements(self, statements):
+        for statement in statements or []:
+            self.resolve_statement(statement)
+
+    def declare(self, node):   # new variable in the innermost scope
+        name = node.get("name")
+        node.resolve_error = None
+        if name in self.scopes[-1]:
+            node.resolve_error = self.report(f"Variable {name} defined more than once")
+            return self.scopes[-1][name]
+        slot = self.next_slot
+        self.next_slot += 1
+        self.nslots = max(self.nslots, self.next_slot)
+        self.scopes[-1][name] = slot
+        return slot
+
+    def lookup(self, node):   # existing variable, innermost scope first
+        name = node.get("name").split(".")[0]   # a.b.c refers to a
+        node.resolve_error = None
+        for scope in reversed(self.scopes):
+            if name in scope:
+                return scope[name]
+        node.resolve_error = self.report(f"Variable {name} has not been defined")
+        return None
+
+    def report(self, description):   # stored on the node, raised when it runs
+        return (ErrorType.NAME_ERROR, description)
+
+    def resolve_statement(self, node):
+        kind = node.elem_type
+        if kind == InterpreterBase.VAR_DEF_NODE:
+            node.slot = self.declare(node)
+        elif kind == "=":
+            self.resolve_expression(node.get("expression"))
+            node.slot = self.lookup(node)
+        elif kind == InterpreterBase.IF_NODE:
+            self.resolve_expression(node.get("condition"))
+            self.resolve_block(node.get("statements"))
+            self.resolve_block(node.get("else_statements"))
+        elif kind == InterpreterBase.FOR_NODE:
+            self.resolve_statement(node.get("init"))
+            self.resolve_expression(node.get("condition"))
+            self.resolve_block(node.get("statements"))
+            self.resolve_statement(node.get("update"))
+        elif kind == InterpreterBase.RETURN_NODE:
+            if node.get("expression") is not None:
+                self.resolve_expression(node.get("expression"))
+        elif kind == InterpreterBase.TRY_NODE:
+            self.resolve_block(node.get("statements"))
+            for catcher in node.get("catchers"):
+                self.resolve_block(catcher.get("statements"))
+        elif kind == InterpreterBase.RAISE_NODE:
+            self.resolve_expression(node.get("exception_type"))
+        else:   # expression statement
+            self.resolve_expression(node)
+
+    def resolve_expression(self, node):
+        kind = node.elem_type
+        if kind == InterpreterBase.VAR_NODE:
+            node.slot = self.lookup(node)
+        elif kind == InterpreterBase.FCALL_NODE:
+            for arg in node.get("args"):
+                self.resolve_expression(arg)
+        else:
+            for child in (node.get("op1"), node.get("op2")):
+                if child is not None:
+                    self.resolve_expression(child)
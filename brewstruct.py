@@ -0,0 +1,117 @@
+from intbase import ErrorType
+
+# Runtime for Brewin structs.
+#
+#   struct node { value: int; next: node; }
+#   ...
+#   n = new node;
+#   n.next = new node;
+#   print(n.next.value);   /* 0 */
+#
+# Every struct definition becomes a StructType when the program is loaded,
+# with the offset of each field worked out once. Instances are StructValues:
+# the type plus a fixed size list of field values, in definition order. New
+# fields start out as the default of their type (0, "", false, nil for
+# structs).
+#
+# A dotted name like a.b.c is split into a FieldPath once, when its var or =
+# node is built (element.py). Each
+# step of the path caches the struct type it saw last and the offset of the
+# field in it, so reading a.b is normally one identity check and a list
+# index. Variables aren't typed, so a step that sees another struct type
+# just looks the field up again and caches that type instead.
+
+FIELD_DEFAULTS = {"int": 0, "string": "", "bool": False}   # fields of a struct type start out nil
+
+
+class StructType:
+    __slots__ = ("name", "field_names", "field_index", "defaults")
+
+    def __init__(self, name, field_names, defaults):
+        self.name = name
+        self.field_names = field_names
+        self.field_index = {field: index for index, field in enumerate(field_names)}   # field -> offset
+        self.defaults = defaults   # initial value of every field, by offset
+
+    def new(self):
+        return StructValue(self, self.defaults.copy())
+
+
+class StructValue:
+    __slots__ = ("struct_type", "values")
+
+    def __init__(self, struct_type, values):
+        self.struct_type = struct_type
+        self.values = values   # field values, by offset
+
+    def __str__(self):
+        return self.struct_type.name
+
+
+# name -> StructType for the struct definitions of a program, error is interpreter.error
+def build_struct_types(struct_nodes, error):
+    names = {node.name for node in struct_nodes}
+    struct_types = {}
+    for node in struct_nodes:
+        if node.name in struct_types:
+            error(ErrorType.NAME_ERROR, f"Struct {node.name} defined more than once", node.line)
+        field_names = []
+        defaults = []
+        for field in node.fields:
+            if field.name in field_names:
+                error(ErrorType.NAME_ERROR, f"Field {field.name} defined more than once in struct {node.name}", field.line)
+            if field.var_type in FIELD_DEFAULTS:
+                defaults.append(FIELD_DEFAULTS[field.var_type])
+            elif field.var_type in names:
+                defaults.append(None)
+            else:
+                error(ErrorType.TYPE_ERROR, f"Unknown type {field.var_type} for field {field.name} of struct {node.name}", field.line)
+            field_names.append(field.name)
+        struct_types[node.name] = StructType(node.name, tuple(field_names), defaults)
+    return struct_types
+
+
+class FieldPath:
+    __slots__ = ("base", "fields", "cache")
+
+    def __init__(self, name):
+        parts = name.split(".")
+        self.base = parts[0]   # variable holding the first struct
+        self.fields = tuple(parts[1:])
+        self.cache = [(None, 0)] * len(self.fields)   # per step: (struct type seen last, offset of the field in it)
+
+    # offset of fields[step] in value, when the inline cache missed
+    def lookup(self, value, step, error, line_num):
+        field = self.fields[step]
+        owner = ".".join((self.base,) + self.fields[:step])
+        if value is None:
+            error(ErrorType.FAULT_ERROR, f"Field {field} accessed through {owner}, which is nil", line_num)
+        if type(value) is not StructValue:
+            error(ErrorType.TYPE_ERROR, f"Field {field} accessed through {owner}, which is not a struct", line_num)
+        index = value.struct_type.field_index.get(field)
+        if index is None:
+            error(ErrorType.NAME_ERROR, f"Struct {value.struct_type.name} has no field {field}", line_num)
+        self.cache[step] = (value.struct_type, index)   # one tuple, so other threads never see half an entry
+        return index
+
+    # value of the field the path names, value is the one of the base variable
+    def get(self, value, error, line_num=None):
+        step = 0
+        for struct_type, index in self.cache:
+            if type(value) is not StructValue or value.struct_type is not struct_type:
+                index = self.lookup(value, step, error, line_num)
+            value = value.values[index]
+            step += 1
+        return value
+
+    def set(self, value, new_value, error, line_num=None):
+        last = len(self.fields) - 1
+        for step in range(last):
+            struct_type, index = self.cache[step]
+            if type(value) is not StructValue or value.struct_type is not struct_type:
+                index = self.lookup(value, step, error, line_num)
+            value = value.values[index]
+        struct_type, index = self.cache[last]
+        if type(value) is not StructValue or value.struct_type is not struct_type:
+            index = self.lookup(value, last, error, line_num)
+        value.values[index] = new_value
@@ -0,0 +1,559 @@
+from array import array
+
+from intbase import BrewinException, ErrorType, InterpreterBase
+from brewresolve import Resolver
+from brewpure import MemoCache
+
+# Bytecode backend: the AST is lowered into flat code objects (one per
+# function) and executed by a stack based virtual machine.
+#
+# Every instruction is two ints in CodeObject.code: the opcode and its
+# argument. Variables are resolved to frame slots by brewresolve before
+# compiling, so the VM never looks a name up while running. The source line
+# of every instruction is kept apart, in CodeObject.lines, and only read
+# when an error has to say where it happened.
+#
+# try/catch doesn't emit any instruction on entry: every function has an
+# exception table with the code range of each of its try blocks and where
+# the catcher for each exception string starts. RAISE looks the raise (and
+# then each waiting call) up in those tables, and cuts the value stack back
+# using the stack depth the compiler recorded at every call site.
+
+# opcodes
+LOAD_CONST = 0   # push consts[arg]
+LOAD_LOCAL = 1   # push frame[arg]
+STORE_LOCAL = 2   # pop into frame[arg]
+DEFINE = 3   # frame[arg] = initial value of a fresh var
+POP = 4   # drop top of stack
+ADD = 5
+SUB = 6
+MUL = 7
+DIV = 8
+EQ = 9
+NE = 10
+LT = 11
+LE = 12
+GT = 13
+GE = 14
+AND = 15
+OR = 16
+NEG = 17
+NOT = 18
+JUMP = 19   # pc = arg
+IF_FALSE = 20   # pop the if condition, jump to arg when false
+FOR_FALSE = 21   # pop the for loop condition, jump to arg when false
+CALL = 22   # call functions[arg], its arguments are on the stack
+PRINT = 23   # print arg values from the stack, push nil
+INPUTI = 24   # inputi with arg values from the stack
+RETURN = 25   # return top of stack
+ERROR = 26   # raise consts[arg] = (error_type, description)
+TAIL_CALL = 27   # return f(...) inside f: pop arg values into the frame, restart at pc 0
+CALL_MEMO = 28   # CALL for a pure function, the result is looked up in / saved to the memo cache
+NEW = 29   # push a new instance of the struct type consts[arg]
+LOAD_FIELD = 30   # replace the struct on top of the stack by the field FieldPath consts[arg] names
+STORE_FIELD = 31   # pop a struct, then a value, and store the value in the field FieldPath consts[arg] names
+RAISE = 32   # pop a string and unwind to the catcher for it
+JUMP_IF_FALSE_OR_POP = 33   # short circuit &&: type check the left operand, jump to arg keeping it when false
+JUMP_IF_TRUE_OR_POP = 34   # short circuit ||: the same, jumping when true
+CHECK_BOOL = 35   # type check the right operand of a short circuit && or ||, left on the stack
+
+OPCODE_NAMES = [
+    "LOAD_CONST", "LOAD_LOCAL", "STORE_LOCAL", "DEFINE", "POP",
+    "ADD", "SUB", "MUL", "DIV", "EQ", "NE", "LT", "LE", "GT", "GE",
+    "AND", "OR", "NEG", "NOT", "JUMP", "IF_FALSE", "FOR_FALSE",
+    "CALL", "PRINT", "INPUTI", "RETURN", "ERROR", "TAIL_CALL", "CALL_MEMO",
+    "NEW", "LOAD_FIELD", "STORE_FIELD", "RAISE",
+    "JUMP_IF_FALSE_OR_POP", "JUMP_IF_TRUE_OR_POP", "CHECK_BOOL",
+]
+
+BINARY_OPCODES = {
+    "+": ADD, "-": SUB, "*": MUL, "/": DIV,
+    "==": EQ, "!=": NE, "<": LT, "<=": LE, ">": GT, ">=": GE,
+    "&&": AND, "||": OR,
+}
+BINARY_OPS = {opcode: op for op, opcode in BINARY_OPCODES.items()}
+
+
+class CodeObject:
+    def __init__(self, name, nparams):
+        self.name = name
+        self.nparams = nparams
+        self.nlocals = nparams   # args take the first slots of the frame, set from the resolver
+        self.code = array("i")
+        self.lines = array("i")   # source line of every instruction, 0 if unknown
+        self.line = 0   # line of the node being compiled
+        self.consts = []
+        self.const_index = {}
+        self.handlers = []   # (start, end, {exception string: catcher pc}) of every try, innermost first
+        self.call_depths = {}   # pc of a CALL -> values the caller has on the stack below the call's args
+
+    def emit(self, op, arg=0):   # returns the position of the instruction, for patching
+        self.code.append(op)
+        self.code.append(arg)
+        self.lines.append(self.line)
+        return len(self.code) - 2
+
+    def line_at(self, pc):   # source line of the instruction at pc
+        return self.lines[pc // 2]
+
+    def patch(self, position, target):
+        self.code[position + 1] = target
+
+    def position(self):
+        return len(self.code)
+
+    def const(self, value):
+        key = (type(value), value)   # keep 1 and true apart
+        if key not in self.const_index:
+            self.const_index[key] = len(self.consts)
+            self.consts.append(value)
+        return self.const_index[key]
+
+    def disassemble(self):
+        lines = [f"{self.name}/{self.nparams} ({self.nlocals} locals)"]
+        for pc in range(0, len(self.code), 2):
+            op, arg = self.code[pc], self.code[pc + 1]
+            detail = ""
+            if op in (LOAD_CONST, ERROR, NEW):
+                detail = f" ({self.consts[arg]!r})"
+            lines.append(f"{self.line_at(pc):4} {pc:6} {OPCODE_NAMES[op]:<12}{arg}{detail}")
+        return "\n".join(lines)
+
+
+class BytecodeProgram:
+    def __init__(self):
+        self.functions = []   # CodeObjects, CALL refers to them by index
+        self.function_index = {}   # (name, arity) -> index
+        self.main = None
+
+
+class BytecodeCompiler:
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+        self.program = BytecodeProgram()
+        self.code = None   # code object being compiled
+        self.func_key = None   # (name, arity) of the function being compiled
+        self.depth = 0   # values the code compiled so far leaves on the stack, in this function
+        self.try_depth = 0   # try blocks around the statement being compiled
+
+    def compile_program(self, ast):
+        Resolver().resolve_program(ast)
+        program = self.program
+        function_nodes = {}
+        for function_node in ast.get("functions"):
+            func_key = (function_node.get("name"), len(function_node.get("args")))
+            if func_key not in program.function_index:
+                program.function_index[func_key] = len(program.functions)
+                program.functions.append(None)
+            function_nodes[func_key] = function_node   # a later duplicate definition wins
+            if func_key[0] == "main":
+                program.main = func_key
+        if program.main is None:
+            self.interpreter.error(ErrorType.NAME_ERROR, "No main() function was found")
+
+        for func_key, function_node in function_nodes.items():
+            self.func_key = func_key
+            program.functions[program.function_index[func_key]] = self.compile_function(function_node)
+        return program
+
+    def compile_function(self, node):
+        args = node.get("args")
+        self.code = CodeObject(node.get("name"), len(args))
+        self.code.nlocals = node.nslots
+        self.code.line = node.line or 0
+        if node.resolve_error is not None:
+            self.emit_error(node.resolve_error)
+        self.compile_block(node.get("statements"))
+        self.code.emit(LOAD_CONST, self.code.const(None))   # falling off the end returns nil
+        self.code.emit(RETURN)
+        return self.code
+
+    def compile_block(self, statements):
+        for statement in statements or []:
+            self.compile_statement(statement)
+
+    def emit_error(self, error):   # error = (error_type, description)
+        self.code.emit(ERROR, self.code.const(error))
+
+    def compile_statement(self, node):   # instructions emitted for node get its line
+        outer_line = self.code.line
+        self.code.line = node.line or outer_line
+        self.depth = 0   # statements start and end with nothing of theirs on the stack
+        self.compile_statement_node(node)
+        self.depth = 0   # a for condition comes right after its init statement
+        self.code.line = outer_line
+
+    def compile_statement_node(self, node):
+        code = self.code
+        kind = node.elem_type
+        if kind == InterpreterBase.VAR_DEF_NODE:
+            if node.resolve_error is not None:
+                self.emit_error(node.resolve_error)
+                return
+            if self.interpreter.initial_value(node.get("var_type")) is None:   # vars of a struct type start out nil
+                code.emit(LOAD_CONST, code.const(None))
+                code.emit(STORE_LOCAL, node.slot)
+                return
+            code.emit(DEFINE, node.slot)
+
+        elif kind == "=":
+            self.compile_expression(node.get("expression"))
+            if node.resolve_error is not None:
+                self.emit_error(node.resolve_error)
+                return
+            if node.field_path is not None:   # struct field
+                code.emit(LOAD_LOCAL, node.slot)
+                code.emit(STORE_FIELD, code.const(node.field_path))
+                return
+            code.emit(STORE_LOCAL, node.slot)
+
+        elif kind == InterpreterBase.IF_NODE:
+            self.compile_expression(node.get("condition"))
+            jump_else = code.emit(IF_FALSE)
+            self.compile_block(node.get("statements"))
+            if node.get("else_statements"):
+                jump_end = code.emit(JUMP)
+                code.patch(jump_else, code.position())
+                self.compile_block(node.get("else_statements"))
+                code.patch(jump_end, code.position())
+            else:
+                code.patch(jump_else, code.position())
+
+        elif kind == InterpreterBase.FOR_NODE:
+            self.compile_statement(node.get("init"))
+            loop_start = code.position()
+            self.compile_expression(node.get("condition"))
+            jump_end = code.emit(FOR_FALSE)
+            self.compile_block(node.get("statements"))
+            self.compile_statement(node.get("update"))
+            code.emit(JUMP, loop_start)
+            code.patch(jump_end, code.position())
+
+        elif kind == InterpreterBase.RETURN_NODE:
+            expression = node.get("expression")
+            if expression is not None and self.is_self_tail_call(expression):
+                for arg in expression.get("args"):
+                    self.compile_expression(arg)
+                code.emit(TAIL_CALL, len(expression.get("args")))
+                return
+            if expression is None:
+                code.emit(LOAD_CONST, code.const(None))
+            else:
+                self.compile_expression(expression)
+            code.emit(RETURN)
+
+        elif kind == InterpreterBase.TRY_NODE:
+            start = code.position()
+            self.try_depth += 1
+            self.compile_block(node.get("statements"))
+            self.try_depth -= 1
+            end = code.position()
+            jumps = [code.emit(JUMP)]
+            table = {}
+            for catcher in node.get("catchers"):
+                if catcher.get("exception_type") in table:   # the first catcher for a string wins
+                    continue
+                table[catcher.get("exception_type")] = code.position()
+                self.compile_block(catcher.get("statements"))
+                jumps.append(code.emit(JUMP))
+            for jump in jumps:
+                code.patch(jump, code.position())
+            code.handlers.append((start, end, table))   # after the tries nested in it
+
+        elif kind == InterpreterBase.RAISE_NODE:
+            self.compile_expression(node.get("exception_type"))
+            code.emit(RAISE)
+
+        else:   # expression statement, value is dropped
+            self.compile_expression(node)
+            code.emit(POP)
+
+    def is_self_tail_call(self, node):   # return f(...) inside f
+        if node.elem_type != InterpreterBase.FCALL_NODE or node.get("name") in ("print", "inputi"):
+            return False
+        if self.try_depth:   # the catchers must still see exceptions from the call
+            return False
+        return (node.get("name"), len(node.get("args"))) == self.func_key
+
+    def compile_expression(self, node):
+        outer_line = self.code.line
+        depth = self.depth
+        self.code.line = node.line or outer_line
+        self.compile_expression_node(node)
+        self.code.line = outer_line
+        self.depth = depth + 1   # every expression leaves one value
+
+    def compile_expression_node(self, node):
+        code = self.code
+        kind = node.elem_type
+        if kind in (InterpreterBase.INT_NODE, InterpreterBase.STRING_NODE, InterpreterBase.BOOL_NODE):
+            code.emit(LOAD_CONST, code.const(node.get("val")))
+        elif kind == InterpreterBase.NIL_NODE:
+            code.emit(LOAD_CONST, code.const(None))
+        elif kind == InterpreterBase.VAR_NODE:
+            if node.resolve_error is not None:
+                self.emit_error(node.resolve_error)
+                return
+            code.emit(LOAD_LOCAL, node.slot)
+            if node.field_path is not None:   # struct field
+                code.emit(LOAD_FIELD, code.const(node.field_path))
+        elif kind == InterpreterBase.NEW_NODE:
+            struct_type = self.interpreter.struct_types.get(node.get("var_type"))
+            if struct_type is None:
+                self.emit_error((ErrorType.TYPE_ERROR, f"Unknown struct type {node.get('var_type')}"))
+                return
+            code.emit(NEW, code.const(struct_type))
+        elif kind in ("&&", "||") and self.interpreter.short_circuit:
+            depth = self.depth
+            self.compile_expression(node.get("op1"))
+            jump_end = code.emit(JUMP_IF_FALSE_OR_POP if kind == "&&" else JUMP_IF_TRUE_OR_POP)
+            self.depth = depth   # the left value is gone when the right one runs
+            self.compile_expression(node.get("op2"))
+            code.emit(CHECK_BOOL)
+            code.patch(jump_end, code.position())
+        elif kind in BINARY_OPCODES:
+            self.compile_expression(node.get("op1"))
+            self.compile_expression(node.get("op2"))
+            code.emit(BINARY_OPCODES[kind])
+        elif kind == InterpreterBase.NEG_NODE:
+            self.compile_expression(node.get("op1"))
+            code.emit(NEG)
+        elif kind == InterpreterBase.NOT_NODE:
+            self.compile_expression(node.get("op1"))
+            code.emit(NOT)
+        elif kind == InterpreterBase.FCALL_NODE:
+            self.compile_call(node)
+        else:
+            self.emit_error((ErrorType.TYPE_ERROR, f"Unsupported expression {kind}"))
+
+    def compile_call(self, node):
+        code = self.code
+        name = node.get("name")
+        args = node.get("args")
+        if name in ("print", "inputi"):
+            for arg in args:
+                self.compile_expression(arg)
+            code.emit(PRINT if name == "print" else INPUTI, len(args))
+            return
+        func_index = self.program.function_index.get((name, len(args)))
+        if func_index is None:
+            self.emit_error((ErrorType.NAME_ERROR, f"Function {name} has not been defined"))
+            return
+        depth = self.depth
+        for arg in args:
+            self.compile_expression(arg)
+        code.call_depths[code.position()] = depth
+        if self.interpreter.memo is not None and (name, len(args)) in self.interpreter.pure_functions:
+            code.emit(CALL_MEMO, func_index)
+        else:
+            code.emit(CALL, func_index)
+
+
+class VirtualMachine:
+    def __init__(self, interpreter, program):
+        self.interpreter = interpreter
+        self.program = program
+        self.code_objects = None   # id of a code array -> its CodeObject, built by the first raise
+
+    def run(self):
+        main = self.program.functions[self.program.function_index[self.program.main]]
+        self.execute(main, [None] * main.nlocals)
+
+    # runs one function call to completion and returns its result.
+    # Brewin calls never recurse in python: CALL saves where the caller was on
+    # the calls list and switches to the callee, RETURN switches back, so the
+    # recursion depth of a program is only bounded by memory. Every function
+    # shares the value stack, each statement leaves it the way it found it.
+    def execute(self, func, frame):
+        interpreter = self.interpreter
+        functions = self.program.functions
+        arithmetic = interpreter.arithmetic
+        compare = interpreter.compare
+        get_type = interpreter.get_type
+        error = interpreter.error
+        code = func.code
+        consts = func.consts
+        memo = interpreter.memo
+        calls = []   # (code, consts, frame, pc, memo key of the call) of every caller that is waiting
+        stack = []
+        push = stack.append
+        pop = stack.pop
+        pc = 0
+        try:
+            while True:
+                op = code[pc]
+                arg = code[pc + 1]
+                pc += 2
+                if op == LOAD_LOCAL:
+                    push(frame[arg])
+                elif op == LOAD_CONST:
+                    push(consts[arg])
+                elif op == STORE_LOCAL:
+                    frame[arg] = pop()
+                elif op == ADD:
+                    value2 = pop()
+                    value1 = stack[-1]
+                    if type(value1) is int and type(value2) is int:
+                        stack[-1] = value1 + value2
+                    else:
+                        stack[-1] = arithmetic("+", value1, value2)
+                elif op == SUB:
+                    value2 = pop()
+                    value1 = stack[-1]
+                    if type(value1) is int and type(value2) is int:
+                        stack[-1] = value1 - value2
+                    else:
+                        stack[-1] = arithmetic("-", value1, value2)
+                elif op == LT:
+                    value2 = pop()
+                    value1 = stack[-1]
+                    if type(value1) is int and type(value2) is int:
+                        stack[-1] = value1 < value2
+                    else:
+                        stack[-1] = compare("<", value1, value2)
+                elif op == IF_FALSE or op == FOR_FALSE:
+                    flag = pop()
+                    if flag is False:
+                        pc = arg
+                    elif flag is not True:
+                        kind = "if statement" if op == IF_FALSE else "for loop"
+                        error(ErrorType.TYPE_ERROR, f"Incompatible types for {kind} condition: " + str(flag))
+                elif op == JUMP:
+                    pc = arg
+                elif op == JUMP_IF_FALSE_OR_POP or op == JUMP_IF_TRUE_OR_POP:
+                    value1 = stack[-1]
+                    if type(value1) is not bool:
+                        error(ErrorType.TYPE_ERROR, "Incompatible types for logical operation: " + get_type(value1))
+                    if value1 is (op == JUMP_IF_TRUE_OR_POP):
+                        pc = arg
+                    else:
+                        pop()
+                elif op == CHECK_BOOL:
+                    if type(stack[-1]) is not bool:
+                        error(ErrorType.TYPE_ERROR, "Incompatible types for logical operation: bool " + get_type(stack[-1]))
+                elif op == MUL:
+                    value2 = pop()
+                    value1 = stack[-1]
+                    if type(value1) is int and type(value2) is int:
+                        stack[-1] = value1 * value2
+                    else:
+                        stack[-1] = arithmetic("*", value1, value2)
+                elif op == DIV:
+                    value2 = pop()
+                    value1 = stack[-1]
+                    if type(value1) is int and type(value2) is int:
+                        stack[-1] = value1 // value2
+                    else:
+                        stack[-1] = arithmetic("/", value1, value2)
+                elif op == CALL or op == CALL_MEMO:
+                    callee = functions[arg]
+                    nparams = callee.nparams
+                    if nparams:
+                        callee_frame = stack[-nparams:]
+                        del stack[-nparams:]
+                    else:
+                        callee_frame = []
+                    memo_key = None
+                    if op == CALL_MEMO:
+                        memo_key = memo.key((callee.name, nparams), callee_frame)
+                        result = memo.get(memo_key)
+                        if result is not MemoCache.MISSING:
+                            push(result)
+                            continue
+                    callee_frame.extend([None] * (callee.nlocals - nparams))
+                    calls.append((code, consts, frame, pc, memo_key))
+                    code = callee.code
+                    consts = callee.consts
+                    frame = callee_frame
+                    pc = 0
+                elif op == RETURN:
+                    if not calls:
+                        return pop()
+                    code, consts, frame, pc, memo_key = calls.pop()   # the return value stays on the stack for the caller
+                    if memo_key is not None:
+                        memo.put(memo_key, stack[-1])
+                elif op == TAIL_CALL:
+                    if arg:
+                        frame[:arg] = stack[-arg:]
+                        del stack[-arg:]
+                    pc = 0
+                elif op == DEFINE:
+                    frame[arg] = ""   # initial value for any var
+                elif op == LOAD_FIELD:
+                    stack[-1] = consts[arg].get(stack[-1], error)
+                elif op == STORE_FIELD:
+                    value1 = pop()
+                    consts[arg].set(value1, pop(), error)
+                elif op == NEW:
+                    push(consts[arg].new())
+                elif op == RAISE:
+                    code, consts, frame, pc = self.unwind(pop(), code, consts, frame, pc, calls, stack)
+                elif op == POP:
+                    pop()
+                elif op == EQ or op == NE or op == LE or op == GT or op == GE:
+                    value2 = pop()
+                    stack[-1] = compare(BINARY_OPS[op], stack[-1], value2)
+                elif op == AND or op == OR:
+                    value2 = pop()
+                    value1 = stack[-1]
+                    if type(value1) is not bool or type(value2) is not bool:
+                        error(ErrorType.TYPE_ERROR, "Incompatible types for logical operation: " + get_type(value1) + " " + get_type(value2))
+                    stack[-1] = (value1 and value2) if op == AND else (value1 or value2)
+                elif op == NEG:
+                    value1 = stack[-1]
+                    if type(value1) is not int:
+                        error(ErrorType.TYPE_ERROR, "Incompatible types for int negation: " + get_type(value1))
+                    stack[-1] = -value1
+                elif op == NOT:
+                    value1 = stack[-1]
+                    if type(value1) is not bool:
+                        error(ErrorType.TYPE_ERROR, "Incompatible types for logical negation: " + get_type(value1))
+                    stack[-1] = not value1
+                elif op == PRINT or op == INPUTI:
+                    if arg:
+                        values = stack[-arg:]
+                        del stack[-arg:]
+                    else:
+                        values = []
+                    if op == PRINT:
+                        interpreter.do_print(values)
+                        push(None)
+                    else:
+                        push(interpreter.do_inputi(values))
+                elif op == ERROR:
+                    error_type, description = consts[arg]
+                    error(error_type, description)
+        except Exception:
+            if interpreter.error_type is not None and interpreter.error_line is None:   # raised without a line, add it
+                line = self.line_of(code, pc - 2)
+                if line:
+                    error(interpreter.error_type, interpreter.error_description, line)
+            raise
+
+    # finds the catcher for a raise at pc - 2, in this function or the
+    # callers waiting in calls, and returns the (code, consts, frame, pc) to
+    # continue at. Raises BrewinException when no try catches it.
+    def unwind(self, exception_type, code, consts, frame, pc, calls, stack):
+        if type(exception_type) is not str:
+            self.interpreter.error(ErrorType.TYPE_ERROR, "Incompatible type for raise: " + self.interpreter.get_type(exception_type))
+        raise_line = self.line_of(code, pc - 2)
+        if self.code_objects is None:
+            self.code_objects = {id(func.code): func for func in self.program.functions}
+        code_objects = self.code_objects
+        while True:
+            for start, end, table in code_objects[id(code)].handlers:
+                if start <= pc - 2 < end and exception_type in table:
+                    base = 0   # where this function's values start on the stack
+                    for caller in calls:
+                        base += code_objects[id(caller[0])].call_depths[caller[3] - 2]
+                    del stack[base:]
+                    return code, consts, frame, table[exception_type]
+            if not calls:
+                raise BrewinException(exception_type, raise_line)
+            code, consts, frame, pc, memo_key = calls.pop()   # the call never returns, nothing to memoize
+
+    def line_of(self, code, pc):   # source line of the instruction at pc in the code array code
+        for func in self.program.functions:
+            if func.code is code:
+                return func.line_at(pc)
+        return 0
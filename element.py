@@ -1,9 +1,9 @@
-class Element:
-    def __init__(self, elem_type, **kwargs):
-        self.elem_type = elem_type
-        self.dict = {}
-        for key, value in kwargs.items():
-            self.dict[key] = value
+from intbase import InterpreterBase
+from brewstruct import FieldPath
+
+
+class ElementBase:   # what Element and the compact nodes share, self.dict is up to the subclass
+    __slots__ = ("elem_type",)
 
     def get(self, key):
         if key not in self.dict:
@@ -17,7 +17,7 @@ class Element:
         return s[0:-2]
 
     def __val(self, v):
-        if isinstance(v, Element):
+        if isinstance(v, ElementBase):
             return "[" + str(v) + "]"
         if isinstance(v, list):
             s = ""
@@ -27,3 +27,303 @@ class Element:
                 return "[" + s[0:-2] + "]"
             return "[" + s + "]"
         return str(v)
+
+
+class Element(ElementBase):
+    __slots__ = ("dict",)
+
+    def __init__(self, elem_type, **kwargs):
+        self.elem_type = elem_type
+        self.dict = {}
+        for key, value in kwargs.items():
+            self.dict[key] = value
+
+
+# Compact node classes built by the parser. Every node type has its fields
+# as __slots__ (no per-instance dict), so engines can read node.op1 directly;
+# get() and str() still work like they do for Element.
+# Slots listed after the fields are annotations filled in by later passes
+# (brewresolve, call site caches) and start out as None, except field_path:
+# var and = nodes with a dotted name (a struct field) get their FieldPath
+# right away, so engines never look for the dots while running. Every node also
+# keeps the line and column (both from 1) it starts at in "line" and "col",
+# None for nodes built outside the parser.
+class Node(ElementBase):   # not an Element, so there is no unused "dict" slot
+    __slots__ = ("line", "col")
+    fields = ()
+
+    def get(self, key):
+        return getattr(self, key, None)
+
+    @property
+    def dict(self):
+        return {field: getattr(self, field) for field in self.fields}
+
+    # pickling (brewcache): save the slots
+    def __getstate__(self):
+        state = {}
+        for cls in type(self).__mro__:
+            for name in cls.__dict__.get("__slots__", ()):
+                if hasattr(self, name):
+                    state[name] = getattr(self, name)
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
+
+class Program(Node):
+    __slots__ = ("structs", "functions")
+    fields = ("structs", "functions")
+
+    def __init__(self, structs, functions, line=None, col=None):
+        self.elem_type = InterpreterBase.PROGRAM_NODE
+        self.line = line
+        self.col = col
+        self.structs = structs
+        self.functions = functions
+
+
+class Struct(Node):
+    __slots__ = ("name", "fields")
+
+    def __init__(self, name, fields, line=None, col=None):
+        self.elem_type = InterpreterBase.STRUCT_NODE
+        self.line = line
+        self.col = col
+        self.name = name
+        self.fields = fields
+
+    @property
+    def dict(self):   # "fields" is a node attribute here, not the field list
+        return {"name": self.name, "fields": self.fields}
+
+
+class FieldDef(Node):
+    __slots__ = ("name", "var_type")
+    fields = ("name", "var_type")
+
+    def __init__(self, name, var_type, line=None, col=None):
+        self.elem_type = InterpreterBase.FIELD_DEF_NODE
+        self.line = line
+        self.col = col
+        self.name = name
+        self.var_type = var_type
+
+
+class Func(Node):
+    __slots__ = ("name", "args", "return_type", "statements", "nslots", "resolve_error")
+    fields = ("name", "args", "return_type", "statements")
+
+    def __init__(self, name, args, return_type, statements, line=None, col=None):
+        self.elem_type = InterpreterBase.FUNC_NODE
+        self.line = line
+        self.col = col
+        self.name = name
+        self.args = args
+        self.return_type = return_type
+        self.statements = statements
+        self.nslots = None
+        self.resolve_error = None
+
+
+class Arg(Node):
+    __slots__ = ("name", "var_type", "slot", "resolve_error")
+    fields = ("name", "var_type")
+
+    def __init__(self, name, var_type, line=None, col=None):
+        self.elem_type = InterpreterBase.ARG_NODE
+        self.line = line
+        self.col = col
+        self.name = name
+        self.var_type = var_type
+        self.slot = None
+        self.resolve_error = None
+
+
+class VarDef(Node):
+    __slots__ = ("name", "var_type", "slot", "resolve_error")
+    fields = ("name", "var_type")
+
+    def __init__(self, name, var_type, line=None, col=None):
+        self.elem_type = InterpreterBase.VAR_DEF_NODE
+        self.line = line
+        self.col = col
+        self.name = name
+        self.var_type = var_type
+        self.slot = None
+        self.resolve_error = None
+
+
+class Assign(Node):
+    __slots__ = ("name", "expression", "slot", "resolve_error", "field_path")
+    fields = ("name", "expression")
+
+    def __init__(self, name, expression, line=None, col=None):
+        self.elem_type = "="
+        self.line = line
+        self.col = col
+        self.name = name
+        self.expression = expression
+        self.slot = None
+        self.resolve_error = None
+        self.field_path = FieldPath(name) if "." in name else None
+
+
+class If(Node):
+    __slots__ = ("condition", "statements", "else_statements", "needs_scope", "else_needs_scope")
+    fields = ("condition", "statements", "else_statements")
+
+    def __init__(self, condition, statements, else_statements, line=None, col=None):
+        self.elem_type = InterpreterBase.IF_NODE
+        self.line = line
+        self.col = col
+        self.condition = condition
+        self.statements = statements
+        self.else_statements = else_statements
+        self.needs_scope = None
+        self.else_needs_scope = None
+
+
+class For(Node):
+    __slots__ = ("init", "condition", "update", "statements", "needs_scope")
+    fields = ("init", "condition", "update", "statements")
+
+    def __init__(self, init, condition, update, statements, line=None, col=None):
+        self.elem_type = InterpreterBase.FOR_NODE
+        self.line = line
+        self.col = col
+        self.init = init
+        self.condition = condition
+        self.update = update
+        self.statements = statements
+        self.needs_scope = None
+
+
+class Return(Node):
+    __slots__ = ("expression",)
+    fields = ("expression",)
+
+    def __init__(self, expression, line=None, col=None):
+        self.elem_type = InterpreterBase.RETURN_NODE
+        self.line = line
+        self.col = col
+        self.expression = expression
+
+
+class Try(Node):
+    __slots__ = ("statements", "catchers", "handlers")
+    fields = ("statements", "catchers")
+
+    def __init__(self, statements, catchers, line=None, col=None):
+        self.elem_type = InterpreterBase.TRY_NODE
+        self.line = line
+        self.col = col
+        self.statements = statements
+        self.catchers = catchers
+        self.handlers = None
+
+
+class Catch(Node):
+    __slots__ = ("exception_type", "statements")
+    fields = ("exception_type", "statements")
+
+    def __init__(self, exception_type, statements, line=None, col=None):
+        self.elem_type = InterpreterBase.CATCH_NODE
+        self.line = line
+        self.col = col
+        self.exception_type = exception_type
+        self.statements = statements
+
+
+class Raise(Node):
+    __slots__ = ("exception_type",)
+    fields = ("exception_type",)
+
+    def __init__(self, exception_type, line=None, col=None):
+        self.elem_type = InterpreterBase.RAISE_NODE
+        self.line = line
+        self.col = col
+        self.exception_type = exception_type
+
+
+class BinOp(Node):   # arithmetic, comparison and logical operators, elem_type is the operator
+    __slots__ = ("op1", "op2")
+    fields = ("op1", "op2")
+
+    def __init__(self, op, op1, op2, line=None, col=None):
+        self.elem_type = op
+        self.line = line
+        self.col = col
+        self.op1 = op1
+        self.op2 = op2
+
+
+class UnaryOp(Node):   # neg and !
+    __slots__ = ("op1",)
+    fields = ("op1",)
+
+    def __init__(self, op, op1, line=None, col=None):
+        self.elem_type = op
+        self.line = line
+        self.col = col
+        self.op1 = op1
+
+
+class New(Node):
+    __slots__ = ("var_type",)
+    fields = ("var_type",)
+
+    def __init__(self, var_type, line=None, col=None):
+        self.elem_type = InterpreterBase.NEW_NODE
+        self.line = line
+        self.col = col
+        self.var_type = var_type
+
+
+class Value(Node):   # int, string and bool literals
+    __slots__ = ("val",)
+    fields = ("val",)
+
+    def __init__(self, elem_type, val, line=None, col=None):
+        self.elem_type = elem_type
+        self.line = line
+        self.col = col
+        self.val = val
+
+
+class Nil(Node):
+    __slots__ = ()
+
+    def __init__(self, line=None, col=None):
+        self.elem_type = InterpreterBase.NIL_NODE
+        self.line = line
+        self.col = col
+
+
+class Var(Node):
+    __slots__ = ("name", "slot", "resolve_error", "field_path")
+    fields = ("name",)
+
+    def __init__(self, name, line=None, col=None):
+        self.elem_type = InterpreterBase.VAR_NODE
+        self.line = line
+        self.col = col
+        self.name = name
+        self.slot = None
+        self.field_path = FieldPath(name) if "." in name else None
+        self.resolve_error = None
+
+
+class FCall(Node):
+    __slots__ = ("name", "args", "target")
+    fields = ("name", "args")
+
+    def __init__(self, name, args, line=None, col=None):
+        self.elem_type = InterpreterBase.FCALL_NODE
+        self.line = line
+        self.col = col
+        self.name = name
+        self.args = args
+        self.target = None
@@ -9,6 +9,13 @@ class ErrorType(Enum):
     # Add others here
 
 
+class BrewinException(Exception):   # a Brewin raise statement on its way to a catch
+    def __init__(self, exception_type, line_num=None):
+        super().__init__(exception_type)
+        self.exception_type = exception_type   # the raised string
+        self.line_num = line_num   # line of the raise
+
+
 class InterpreterBase:
     # AST node types
     PROGRAM_NODE = "program"
@@ -40,9 +47,10 @@ class InterpreterBase:
     VOID_DEF = "void"
     
     # methods
-    def __init__(self, console_output=True, inp=None):
+    def __init__(self, console_output=True, inp=None, output_sink=None):
         self.console_output = console_output
-        self.inp = inp  # if not none, then read input from passed-in list
+        self.inp = inp  # if not none, then read input from passed-in list or brewio input source
+        self.output_sink = output_sink  # if not none, a brewio sink that gets the output instead of output_log
         self.reset()
 
     # Call to reset I/O for another run of the program
@@ -51,13 +59,17 @@ class InterpreterBase:
         self.input_cursor = 0
         self.error_type = None
         self.error_line = None
+        self.error_description = None
 
     # Students must implement this in their derived class
     def run(self, program):
         pass
 
     def get_input(self):
+        if hasattr(self.inp, "next_value"):  # brewio input source, values are read lazily
+            return self.inp.next_value()
         if not self.inp:
+            self.flush_output()  # make sure buffered prompts show up first
             return input()  # Get input from keyboard if not input list provided
 
         if self.input_cursor < len(self.inp):
@@ -66,11 +78,18 @@ class InterpreterBase:
             return cur_input
         return None
 
+    # get_input() for inputi, input sources can hand back ints without converting
+    def get_int_input(self):
+        if hasattr(self.inp, "next_int"):
+            return self.inp.next_int()
+        return int(self.get_input())
+
     # students must call this for any errors that they run into
     def error(self, error_type, description=None, line_num=None):
         # log the error before we throw
         self.error_line = line_num
         self.error_type = error_type
+        self.error_description = description
 
         if description:
             description = ": " + description
@@ -81,11 +100,21 @@ class InterpreterBase:
         raise Exception(f"{error_type} on line {line_num}{description}")
 
     def output(self, v):
+        if self.output_sink is not None:
+            self.output_sink.write(v)
+            return
         if self.console_output:
             print(v)
         self.output_log.append(v)
 
+    # push out anything a buffered output sink is still holding
+    def flush_output(self):
+        if self.output_sink is not None:
+            self.output_sink.flush()
+
     def get_output(self):
+        if self.output_sink is not None:
+            return self.output_sink.lines()
         return self.output_log
 
     def get_error_type_and_line(self):
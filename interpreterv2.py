@@ -1,34 +1,96 @@
-from intbase import ErrorType, InterpreterBase
+from intbase import BrewinException, ErrorType, InterpreterBase
 from brewparse import parse_program
+from brewclosure import TAIL_CALL, ClosureCompiler
+from brewvm import BytecodeCompiler, VirtualMachine
+from brewopt import Optimizer
+from brewpure import PurityAnalyzer, MemoCache
+from brewstruct import StructValue, build_struct_types
 
 
 class Interpreter(InterpreterBase):
-    def __init__(self, console_output=True, inp=None, trace_output=False):
-        super().__init__(console_output, inp)  
-        self.trace_output = 0  #for debugging purposes
+    ENGINES = ["tree", "closure", "vm"]   # tree: walk the AST, closure: compile it to python closures, vm: compile it to bytecode (no python recursion, deep brewin recursion is fine)
+    
+    def __init__(self, console_output=True, inp=None, trace_output=False, engine="tree", ast_cache=None, output_sink=None,
+                 optimize=False, memoize=False, memo_entries=10000, profiler=None, short_circuit=True):
+        super().__init__(console_output, inp, output_sink)  
+        self.trace_output = trace_output  #for debugging purposes
+        if engine not in self.ENGINES:
+            raise ValueError(f"Unknown engine {engine}, expected one of {self.ENGINES}")
+        if profiler is not None and engine == "vm":
+            raise ValueError("Profiling is supported by the tree and closure engines only")
+        self.engine = engine
+        self.ast_cache = ast_cache   # optional brewcache.ASTCache, shared between interpreters
+        self.optimize = optimize   # run the brewopt constant folding pass before executing
+        self.memoize = memoize   # cache the results of pure functions (brewpure)
+        self.memo_entries = memo_entries   # size of that cache, least recently used results are dropped
+        self.memo = None
+        self.pure_functions = set()   # (name, arity) of the functions whose results are cached
+        self.profiler = profiler   # optional brewprof.Profiler, filled in while the program runs
+        self.short_circuit = short_circuit   # && and || skip the right operand when the left one decides, False evaluates both
+        self.struct_types = {}   # name -> brewstruct.StructType of the program running
         
     def run(self, program):
-        ast = parse_program(program)  #program node (root)
+        self.error_type = None   #errors from an earlier run don't count
+        self.error_line = None
+        if self.ast_cache is not None:
+            ast = self.ast_cache.parse(program)  #program node (root)
+        else:
+            ast = parse_program(program)  #program node (root)
+        if self.optimize:
+            ast = Optimizer(self.short_circuit).optimize_program(ast)
+        try:
+            self.run_program(ast)
+        finally:
+            self.flush_output()   #buffered output sinks write out what they still hold
+    
+    def run_program(self, ast):
+        try:
+            self.execute_program(ast)
+        except BrewinException as e:   #a raise that no catch took
+            super().error(ErrorType.FAULT_ERROR, f"Uncaught exception {e.exception_type}", e.line_num)
+
+    def execute_program(self, ast):
+        self.struct_types = build_struct_types(ast.structs, self.error)   #field offsets, worked out once
+        if self.memoize:
+            self.pure_functions = PurityAnalyzer().analyze_program(ast)
+            self.memo = MemoCache(self.memo_entries)
+        if self.engine == "closure":
+            main = ClosureCompiler(self).compile_program(ast)
+            main()
+            return
+        if self.engine == "vm":
+            VirtualMachine(self, BytecodeCompiler(self).compile_program(ast)).run()
+            return
         
-        var_name_to_value = {}  # dict to hold variables
         self.functions = {} # hold defined functions
-        self.scope_stack = [var_name_to_value]   #scope stack to save scopes
+        self.scope_stack = []   #block scopes of the running function, innermost last; every call gets its own list
         main_node = 0
-        self.function_output = None #saving rerturn values
-        for function_node in ast.get("functions"):
-            
-            if function_node.get("name") == "main":
+        self.function_lines = {}
+        self.current_function = None   #functions entry of the function running now, for tail calls
+        self.tail_call_args = None   #args of a pending self tail call
+        self.try_depth = 0   #try blocks of the running function we are inside, no tail calls out of those
+        for function_node in ast.functions:   #define functions
+            name =  function_node.name
+            params = tuple(arg.name for arg in function_node.args)   #frame layout of the function
+            statements = function_node.statements
+            self.functions[(name, len(params))] = (params, statements)   # foo(a) = ("foo", 1)  foo(a,b) = ("foo", 2)
+            self.function_lines[(name, len(params))] = function_node.line   #for the profiler
+            self.mark_scopes(statements)
+            if name == "main":
                 main_node = function_node
-                continue
-            else:  #define functions
-                name =  function_node.get("name")
-                args =  function_node.get("args")
-                statements = function_node.get("statements")
-                func_key = name + str(len(args))   # foo(a) = "foo1"  foo(a,b) = "foo2"
-                self.functions[func_key] = [args,statements]
         # print(self.functions)
+        if self.profiler is not None:   #swap in the counting versions, nothing to check when not profiling
+            self.run_statement = self.profiled_statement
+            self.run_function = self.profiled_function
         if main_node:
-            self.run_main(main_node)
+            if self.profiler is not None:
+                self.profiler.enter("main", main_node.line)
+                try:
+                    self.run_main(main_node)
+                finally:
+                    self.profiler.exit()
+            else:
+                self.run_main(main_node)
         else:
             super().error(ErrorType.NAME_ERROR,"No main() function was found",)
         if self.trace_output:
@@ -41,10 +103,38 @@ class Interpreter(InterpreterBase):
 
             
             
+    # sets needs_scope on the if/for nodes in statements: only blocks that
+    # declare vars get a scope of their own, the rest run in the enclosing one
+    def mark_scopes(self, statements):
+        for statement in statements or []:
+            if statement.elem_type == "if":
+                statement.needs_scope = self.declares_vars(statement.statements)
+                statement.else_needs_scope = self.declares_vars(statement.else_statements)
+                self.mark_scopes(statement.statements)
+                self.mark_scopes(statement.else_statements)
+            elif statement.elem_type == "for":
+                statement.needs_scope = self.declares_vars(statement.statements)
+                self.mark_scopes(statement.statements)
+            elif statement.elem_type == "try":
+                self.mark_scopes(statement.statements)
+                for catcher in statement.catchers:
+                    self.mark_scopes(catcher.statements)
+
+    def declares_vars(self, statements):   # nested blocks have their own scopes, only direct vardefs count
+        return any(statement.elem_type == "vardef" for statement in statements or [])
+
     def run_main(self, function_node):  #running the main function
-        
-        for statement in function_node.get("statements"):
-            self.run_statement(statement)
+        self.scope_stack = [{}]
+        self.run_block(function_node.statements)   #a return just ends main
+
+    # statements return None to keep going, (value,) when a return statement
+    # ran, or TAIL_CALL for "return f(...)" inside f; blocks hand that straight up
+    def run_block(self, statements):
+        for statement in statements:
+            result = self.run_statement(statement)
+            if result is not None:
+                return result
+        return None
     
     def run_statement(self, statement_node):
         if statement_node.elem_type == "vardef":   #variable defination
@@ -62,370 +152,450 @@ class Interpreter(InterpreterBase):
         elif statement_node.elem_type == "for":   #for loop
             return self.for_loop(statement_node)
         
-        elif statement_node.elem_type == "return":   #for loop
-            self.return_from(statement_node)
+        elif statement_node.elem_type == "try":   #try with catchers
+            return self.try_statement(statement_node)
+
+        elif statement_node.elem_type == "raise":
+            self.raise_exception(statement_node)
+        
+        elif statement_node.elem_type == "return":   #return, the scopes go away with the call
+            result = self.return_from(statement_node)
             if self.trace_output:
                 print("returned")
-            # stack pop to boundtry (none)
-            while self.scope_stack:
-                popped_element = self.scope_stack.pop()
-            
-                if popped_element is None:
-                    # print("Encountered None, stopping.")
-                    break
-            return "returned"
-        return "continue"
+            return result
+
+        else:   #expression statement, evaluated for its side effects and errors like the other engines do
+            self.eval_expression(statement_node)
+        return None
 
     
     def do_defination(self, statement_node):   #define variable in the local scope
-        var_name = statement_node.get("name")
+        var_name = statement_node.name
         
         stack = self.scope_stack
         scope = stack[-1]    #current scope
         if var_name in scope:
-            super().error(ErrorType.NAME_ERROR, f"Variable {var_name} defined more than once",)
+            super().error(ErrorType.NAME_ERROR, f"Variable {var_name} defined more than once", statement_node.line)
             return
-        scope[var_name] = ""   #initial value for any var
+        scope[var_name] = self.initial_value(statement_node.var_type)
         if self.trace_output:
             print("defined variable", var_name)        
     
     def do_assignment(self, statement_node):    #assign variable in the current scopes
-        target_var_name = statement_node.get("name")
-        expression_node = statement_node.get("expression")
+        target_var_name = statement_node.name
+        expression_node = statement_node.expression
         resulting_value = self.eval_expression(expression_node)
+        path = statement_node.field_path
+        if path is not None:   #struct field, a.b.c
+            scope = self.find_scope(path.base, statement_node.line)
+            path.set(scope[path.base], resulting_value, self.error, statement_node.line)
+            return
         
-        stack = self.scope_stack
-        for scope in reversed(stack):   
-            if scope is None: # Stop at the function boundary marker
-                break
+        for scope in reversed(self.scope_stack):   
             if target_var_name in scope:
                 scope[target_var_name] = resulting_value
                 return
-        super().error(ErrorType.NAME_ERROR,f"Variable {target_var_name} has not been defined",)
+        super().error(ErrorType.NAME_ERROR,f"Variable {target_var_name} has not been defined", statement_node.line)
 
         if self.trace_output:
                 print(target_var_name, "assigned", resulting_value)
 
+    def find_scope(self, var_name, line_num=None):   #innermost scope of the running function that has var_name
+        for scope in reversed(self.scope_stack):
+            if var_name in scope:
+                return scope
+        super().error(ErrorType.NAME_ERROR,f"Variable {var_name} has not been defined", line_num)
+
+    def initial_value(self, var_type):   # value of a fresh var, vars of a struct type start out nil
+        if var_type in self.struct_types:
+            return None
+        return ""
+
+    def new_struct(self, type_name, line_num=None):
+        struct_type = self.struct_types.get(type_name)
+        if struct_type is None:
+            super().error(ErrorType.TYPE_ERROR, f"Unknown struct type {type_name}", line_num)
+        return struct_type.new()
+
         
-    def find_type(self, op):
-        #the input op can be a expression, var   
-        type = op.elem_type     #when it is a expression or variable
-        if type == "var":    
-            if isinstance(self.eval_expression(op), str):
-                type = "string"
-            if isinstance(self.eval_expression(op), int):
-                type = "int"
-            if isinstance(self.eval_expression(op), bool):
-                type = "bool"
-            if self.eval_expression(op) is None:
-                type = "nil"   
-        elif type == "fcall":
-            type = "ok"
-            # self.eval_expression(op)
-            # if isinstance(self.function_output, str):
-            #     type = "string"
-            # if isinstance(self.function_output, int):
-            #     type = "int"
-            # if isinstance(self.function_output, bool):
-            #     type = "bool"
-            # if self.function_output is None:
-            #     type = "nil"   
-        else:
-            return type
-        return type
-    
-    def match_type(self, t1, t2):   # see if two types match for comparison
-        allowed = [
-            {"int", "+"}, {"int", "-"}, {"int", "neg"}, {"int", "*"}, {"int", "/"}, 
-            {"+", "-"}, {"+", "neg"}, {"+", "*"}, {"+", "/"}, {"-", "neg"}, 
-            {"-", "*"}, {"-", "/"}, {"neg", "*"}, {"neg", "/"}, {"*", "/"}
-        ]
-        if t1 == "ok" or t2 == "ok" or {t1,t2} in allowed:
-            return True
-        return t1 == t2
-    
     def eval_expression(self, expression_node):
         try:
             expression_node.elem_type
         except:
             return expression_node
         if expression_node.elem_type == "var":  #get and its value if it is a variable
-            var_name = expression_node.get("name")
+            var_name = expression_node.name
+            path = expression_node.field_path
+            if path is not None:   #struct field, a.b.c
+                value = self.find_scope(path.base, expression_node.line)[path.base]
+                return path.get(value, self.error, expression_node.line)
             
             for scope in reversed(self.scope_stack): #get the variable value in the current scopes
-                if scope is None:  # Stop at the function boundary marker
-                    break
                 if var_name in scope:
                     return scope[var_name]
-            super().error(ErrorType.NAME_ERROR,f"Variable {var_name} has not been defined",)
+            super().error(ErrorType.NAME_ERROR,f"Variable {var_name} has not been defined", expression_node.line)
 
             # if not var_name in self.variable_name_to_value.keys():
             #     super().error(ErrorType.NAME_ERROR,f"Variable {var_name} has not been defined",)
             # return self.variable_name_to_value[var_name]
         
         elif expression_node.elem_type in ["int", "string","bool"]:  #return if it is a value
-            return expression_node.get("val")
+            return expression_node.val
         elif expression_node.elem_type == "nil":
             return None
+        elif expression_node.elem_type == "new":
+            return self.new_struct(expression_node.var_type, expression_node.line)
         elif expression_node.elem_type in ["+","-", "*","/"]:   #calculate if it is arithmetic binary op
-            op1 = expression_node.get("op1")
-            op2 = expression_node.get("op2")
-            type1 = self.find_type(op1)
-            type2 = self.find_type(op2)
-            # if string + string: ok to concatenate
-            # otherwise non-int not allowed [nil, bool, string]
-    
+            # evaluate each operand exactly once, then type check the values
+            value1 = self.eval_expression(expression_node.op1)
+            value2 = self.eval_expression(expression_node.op2)
             if self.trace_output:   
-                print("calculating",type1, type2, expression_node.elem_type)
-            
-            if expression_node.elem_type ==  "+": #concatenation valid cases and invalid cases
-                if isinstance(self.eval_expression(op1), str) and isinstance(self.eval_expression(op2), str):
-                    return self.eval_expression(op1) + self.eval_expression(op2)
-                if isinstance(self.eval_expression(op1), str) and isinstance(self.eval_expression(op2), int):
-                    super().error(ErrorType.TYPE_ERROR,"Incompatible types for arithmetic operation:"+type1+" "+type2,)
-                if isinstance(self.eval_expression(op2), str) and isinstance(self.eval_expression(op1), int):
-                    super().error(ErrorType.TYPE_ERROR,"Incompatible types for arithmetic operation:"+type1+" "+type2,)
-            
-            
-            if type1 in ["string", "bool", "nil"] or type2 in ["string", "bool", "nil"]:
-                super().error(ErrorType.TYPE_ERROR,"Incompatible types for arithmetic operation: "+type1+" "+type2,)
-                return
-            if expression_node.elem_type ==  "+":
-                return self.eval_expression(op1) + self.eval_expression(op2)
-            if expression_node.elem_type ==  "-":
-                return self.eval_expression(op1) - self.eval_expression(op2)
-            if expression_node.elem_type ==  "*":
-                return self.eval_expression(op1) * self.eval_expression(op2)
-            if expression_node.elem_type ==  "/":
-                return self.eval_expression(op1) // self.eval_expression(op2)
+                print("calculating",self.get_type(value1), self.get_type(value2), expression_node.elem_type)
+            return self.arithmetic(expression_node.elem_type, value1, value2, expression_node.line)
             
         elif expression_node.elem_type == "fcall":  #function call only case is inputi()
-            self.call_function(expression_node)
-            return self.function_output
+            return self.call_function(expression_node)
         
         elif expression_node.elem_type == "neg":  # unary negation
-            op1 = expression_node.get("op1")
-            type1 = self.find_type(op1)
+            value1 = self.eval_expression(expression_node.op1)
+            type1 = self.get_type(value1)
             if not type1 == "int":  #only for int
-                super().error(ErrorType.TYPE_ERROR,"Incompatible types for int negation: "+type1)
-            return -1*self.eval_expression(op1)
+                super().error(ErrorType.TYPE_ERROR,"Incompatible types for int negation: "+type1, expression_node.line)
+            return -value1
         
         elif expression_node.elem_type == "!":  # logical negation
-            op1 = expression_node.get("op1")
-            type1 = self.find_type(op1)
-            allowed_types = ["bool",'==', '<', '<=', '>', '>=', '!=',"||","&&","!"]
-            if not type1 in allowed_types:  #only for int
-                super().error(ErrorType.TYPE_ERROR,"Incompatible types for logical negation: "+type1)
-            return not self.eval_expression(op1)
+            value1 = self.eval_expression(expression_node.op1)
+            type1 = self.get_type(value1)
+            if not type1 == "bool":  #only for bool
+                super().error(ErrorType.TYPE_ERROR,"Incompatible types for logical negation: "+type1, expression_node.line)
+            return not value1
         
-        elif expression_node.elem_type in ['||', '&&']:   #logical operation
-            op1 = expression_node.get("op1")     #get the type of left and right
-            op2 = expression_node.get("op2")
-            type1 = self.find_type(op1)
-            type2 = self.find_type(op2)
-            
-            allowed_types = ["bool",'==', '<', '<=', '>', '>=', '!=',"||","&&","!"]
-            if not type1 in allowed_types or not type2 in allowed_types:
-                super().error(ErrorType.TYPE_ERROR,"Incompatible types for logical operation: "+type1+" "+type2,)
+        elif expression_node.elem_type in ['||', '&&']:   #logical operation, every operand is evaluated at most once
+            value1 = self.eval_expression(expression_node.op1)
+            if self.short_circuit:
+                if not isinstance(value1, bool):   #type checked as soon as it is known
+                    super().error(ErrorType.TYPE_ERROR,"Incompatible types for logical operation: "+self.get_type(value1), expression_node.line)
+                if value1 == (expression_node.elem_type == "||"):   #false && ... / true || ..., the right side is skipped
+                    return value1
+                value2 = self.eval_expression(expression_node.op2)
+                if not isinstance(value2, bool):
+                    super().error(ErrorType.TYPE_ERROR,"Incompatible types for logical operation: bool "+self.get_type(value2), expression_node.line)
+                return value2
+            value2 = self.eval_expression(expression_node.op2)   #strict evaluation
+            if not isinstance(value1, bool) or not isinstance(value2, bool):
+                super().error(ErrorType.TYPE_ERROR,"Incompatible types for logical operation: "+self.get_type(value1)+" "+self.get_type(value2), expression_node.line)
             if expression_node.elem_type ==  "||":
-                return (lambda: self.eval_expression(op1))() or (lambda: self.eval_expression(op2))() #strict evaluation
-            if expression_node.elem_type ==  "&&":
-                return (lambda: self.eval_expression(op1))() and (lambda: self.eval_expression(op2))() #strict evaluation
+                return value1 or value2
+            return value1 and value2
 
         elif expression_node.elem_type in ['==', '<', '<=', '>', '>=', '!=']:   #compare operations
-            op1 = expression_node.get("op1")     #get the type of left and right
-            op2 = expression_node.get("op2")
-            type1 = self.find_type(op1)
-            type2 = self.find_type(op2)
+            value1 = self.eval_expression(expression_node.op1)   #evaluate left and right once
+            value2 = self.eval_expression(expression_node.op2)
             if self.trace_output:
-                print("comparing",type1, type2, expression_node.elem_type)
-            
-            if not self.match_type(type1,type2):     #if two types dont match
-                if expression_node.elem_type == '==':
-                    return False
-                elif expression_node.elem_type == '!=':
-                    return True
-                else:
-                    super().error(ErrorType.TYPE_ERROR,"Incompatible types for comparison operation: "+type1+" "+type2,)
-            
-            #if the types do match
-            if expression_node.elem_type == '==':
-                return self.eval_expression(op1) == self.eval_expression(op2)
-            if expression_node.elem_type == '<':
-                return self.eval_expression(op1) < self.eval_expression(op2)
-            if expression_node.elem_type == '>':
-                return self.eval_expression(op1) > self.eval_expression(op2)
-            if expression_node.elem_type == '<=':
-                return self.eval_expression(op1) <= self.eval_expression(op2)
-            if expression_node.elem_type == '>=':
-                return self.eval_expression(op1) >= self.eval_expression(op2)
-            if expression_node.elem_type == '!=':
-                return not self.eval_expression(op1) == self.eval_expression(op2)
+                print("comparing",self.get_type(value1), self.get_type(value2), expression_node.elem_type)
+            return self.compare(expression_node.elem_type, value1, value2, expression_node.line)
             
+    def get_type(self, value):   # type name of an already evaluated value
+        if value is None:
+            return "nil"
+        if isinstance(value, bool):   # check bool before int, bool is a subclass of int
+            return "bool"
+        if isinstance(value, int):
+            return "int"
+        if isinstance(value, str):
+            return "string"
+        if isinstance(value, StructValue):   # structs are compared by identity, only to their own type and nil
+            return value.struct_type.name
+        return "ok"
+    
+    def arithmetic(self, op, value1, value2, line_num=None):   # +,-,*,/ on evaluated operands, line_num is for errors
+        type1 = self.get_type(value1)
+        type2 = self.get_type(value2)
+        if type1 == "int" and type2 == "int":
+            if op ==  "+":
+                return value1 + value2
+            if op ==  "-":
+                return value1 - value2
+            if op ==  "*":
+                return value1 * value2
+            if op ==  "/":
+                return value1 // value2
+        if op == "+" and type1 == "string" and type2 == "string":   #concatenation
+            return value1 + value2
+        super().error(ErrorType.TYPE_ERROR,"Incompatible types for arithmetic operation: "+type1+" "+type2, line_num)
+    
+    def compare(self, op, value1, value2, line_num=None):   # comparison on evaluated operands, line_num is for errors
+        type1 = self.get_type(value1)
+        type2 = self.get_type(value2)
+        if not type1 == type2:     #if two types dont match
+            if op == '==':
+                return False
+            elif op == '!=':
+                return True
+            super().error(ErrorType.TYPE_ERROR,"Incompatible types for comparison operation: "+type1+" "+type2, line_num)
+        
+        #if the types do match
+        if op == '==':
+            return value1 == value2
+        if op == '!=':
+            return not value1 == value2
+        if not type1 in ["int", "string"]:   #only ints and strings can be ordered
+            super().error(ErrorType.TYPE_ERROR,"Incompatible types for comparison operation: "+type1+" "+type2, line_num)
+        if op == '<':
+            return value1 < value2
+        if op == '>':
+            return value1 > value2
+        if op == '<=':
+            return value1 <= value2
+        if op == '>=':
+            return value1 >= value2
 
     def call_function(self, statement_node):
-        parameters = statement_node.get("args")   #list of parameters, each is an expressions
-        func_name = statement_node.get("name")
-        func_key = func_name + str(len(parameters))
-        # print(func_key)
+        parameters = statement_node.args   #list of parameters, each is an expressions
+        func_name = statement_node.name
         if self.trace_output:
             print(f"tried to call {func_name}")
             
         if func_name == "print":
-            output = ""
-            for i in parameters:
-                parts = self.eval_expression(i)
-                if str(parts) == "True":  #fix True to be true
-                    parts = "true"
-                if str(parts) == "False":
-                    parts = "false"
-                output += str(parts)
-            super().output(output)
-            if self.trace_output:
-                print("printed: "+output)
+            self.do_print([self.eval_expression(i) for i in parameters])
                 
         elif func_name == "inputi":
-            if len(parameters) == 1:
-                super().output(parameters[0].get("val"))
-            elif len(parameters) > 1:
-                super().error(ErrorType.NAME_ERROR,f"No inputi() function found that takes > 1 parameter",)
-            user_input = super().get_input()
-            self.function_output = int(user_input)
-            return int(user_input)
+            return self.do_inputi([self.eval_expression(i) for i in parameters], statement_node.line)
         
-        elif func_key in self.functions:   #a self defined function
+        else:   #a self defined function
+            target = self.lookup_function(statement_node)
             if self.trace_output:
-                print(func_key,"is called with",parameters)
-            args = self.functions[func_key][0]   #list of arguments
-            statements = self.functions[func_key][1]
-            
-            # start to scope
-            self.scope_stack.append(None)   #set a function boundry marker
-            func_scope = {}
-            self.scope_stack.append(func_scope)  #scope is ready
-            for i in range(len(args)):   #define and set the arguments
-                self.do_defination(args[i])
-                self.do_assignment(  { "name": args[i].get("name"), "expression":parameters[i]} )
+                print(func_name,"is called with",parameters)
             
-            for statement in statements:
-                result = self.run_statement(statement)
-                
-                if not result == "continue":
+            # arguments are evaluated in the caller's scope, then bound into the new frame
+            values = [self.eval_expression(p) for p in parameters]
+            if self.memo is not None and (func_name, len(parameters)) in self.pure_functions:
+                memo_key = self.memo.key((func_name, len(parameters)), values)
+                result = self.memo.get(memo_key)
+                if result is not MemoCache.MISSING:
+                    return result
+                result = self.run_function(func_name, target, values)
+                self.memo.put(memo_key, result)
+                return result
+            return self.run_function(func_name, target, values)
+
+    def run_function(self, func_name, target, values):   #runs the body of a user function with its arg values
+        params, statements = target
+        caller_function = self.current_function
+        caller_scopes = self.scope_stack
+        caller_try_depth = self.try_depth
+        self.current_function = target
+        self.try_depth = 0
+        try:
+            while True:   #one pass per call, "return f(...)" to this same function loops instead of recursing
+                func_scope = dict(zip(params, values))
+                if len(func_scope) < len(params):   # the same name used for two formal args
+                    name = next(name for i, name in enumerate(params) if name in params[:i])   # the first one repeated
+                    super().error(ErrorType.NAME_ERROR, f"Variable {name} defined more than once",
+                                  self.function_lines[(func_name, len(params))])
+                self.scope_stack = [func_scope]   #scopes of this call only, dropped as a whole when it ends
+                result = self.run_block(statements)
+                if result is not TAIL_CALL:
                     if self.trace_output:
-                        print("return from",func_key)
+                        print("return from",func_name)
+                    if result is None:   #no return statement, the result is nil
+                        return None
+                    return result[0]
+                values = self.tail_call_args
+                self.tail_call_args = None
+        finally:
+            self.current_function = caller_function
+            self.scope_stack = caller_scopes
+            self.try_depth = caller_try_depth
+    
+    def profiled_statement(self, statement_node):
+        if statement_node.get("line") is not None:
+            self.profiler.count_line(statement_node.line)
+        return Interpreter.run_statement(self, statement_node)
 
-                    return self.function_output
-            #remove the scope
-            self.scope_stack.pop()
-            self.scope_stack.pop()
-            return self.function_output  #default return
-                
-            
-        else:  #invalid function call
-            super().error(ErrorType.NAME_ERROR,f"Function {func_name} has not been defined",)
+    def profiled_function(self, func_name, target, values):
+        self.profiler.enter(func_name, self.function_lines[(func_name, len(target[0]))])
+        try:
+            return Interpreter.run_function(self, func_name, target, values)
+        finally:
+            self.profiler.exit()
+
+    def is_self_tail_call(self, expression):
+        if expression is None or expression.elem_type != "fcall" or expression.name in ("print", "inputi"):
+            return False
+        if self.try_depth:   #the catchers must still see exceptions from the call
+            return False
+        return self.current_function is not None and self.lookup_function(expression) is self.current_function
+
+    def lookup_function(self, fcall_node):   # dispatch table lookup, done once per call site
+        target = fcall_node.target
+        if target is None:
+            func_key = (fcall_node.name, len(fcall_node.args))
+            if func_key not in self.functions:  #invalid function call
+                super().error(ErrorType.NAME_ERROR,f"Function {func_key[0]} has not been defined", fcall_node.line)
+            target = self.functions[func_key]
+            fcall_node.target = target   # the table only depends on the AST, so the cache stays valid
+        return target
+    
+    
+    def to_printable(self, value):   # how a value shows up in print()
+        if value is True:
+            return "true"
+        if value is False:
+            return "false"
+        if value is None:
+            return "nil"
+        return str(value)
+    
+    def do_print(self, values):   # print() on already evaluated arguments
+        output = "".join(self.to_printable(v) for v in values)
+        super().output(output)
+        if self.trace_output:
+            print("printed: "+output)
+    
+    def do_inputi(self, values, line_num=None):   # inputi() on already evaluated arguments (optional prompt)
+        if len(values) > 1:
+            super().error(ErrorType.NAME_ERROR,f"No inputi() function found that takes > 1 parameter", line_num)
+        if values:
+            super().output(self.to_printable(values[0]))
+        return super().get_int_input()
     
     
     def if_statement(self, statement_node):   #if branching
-        condition = self.eval_expression(statement_node.get("condition"))  #expression, variable or value
-        true_statements = statement_node.get("statements")
-        false_statements = statement_node.get("else_statements")
+        condition = self.eval_expression(statement_node.condition)  #expression, variable or value
 
         if not isinstance(condition, bool): #only bool condition is allowed
-            super().error(ErrorType.TYPE_ERROR,"Incompatible types for if statement condition: "+str(condition))
+            super().error(ErrorType.TYPE_ERROR,"Incompatible types for if statement condition: "+str(condition), statement_node.line)
             
-        # start to scope
-        if_scope = {}
-        self.scope_stack.append(if_scope)
-        
         if condition:
-            for s in true_statements:
-                result = self.run_statement(s)
-                
-                if not result == "continue":
-                    return "returned"
+            statements = statement_node.statements
+            needs_scope = statement_node.needs_scope
         else:
-            if false_statements:   #if there is a else statement
-                for s in false_statements:
-                    result = self.run_statement(s)
-                
-                    if not result == "continue":
-                        return "returned"
-                    
-        # possible scoping
+            statements = statement_node.else_statements
+            needs_scope = statement_node.else_needs_scope
+        if not statements:   #no else
+            return None
+        if not needs_scope:   #no vars declared, nothing to put in a scope
+            return self.run_block(statements)
+        self.scope_stack.append({})
+        result = self.run_block(statements)
         self.scope_stack.pop()
+        return result
     
     def for_loop(self, statement_node):    #for loop
-        init = statement_node.get("init")
-        self.run_statement(init)
-        flag = self.eval_expression(statement_node.get("condition"))
-        update = statement_node.get("update")
-        statements = statement_node.get("statements")
-
-        if not isinstance(flag, bool): #only bool condition is allowed
-            super().error(ErrorType.TYPE_ERROR,"Incompatible types for for loop condition: "+str(flag))
-
-        while(flag):
-            for s in statements:
-                result = self.run_statement(s)
-                
-                if not result == "continue":
-                    return "returned"
-                
+        self.run_statement(statement_node.init)
+        condition = statement_node.condition
+        update = statement_node.update
+        statements = statement_node.statements
+
+        body_scope = {} if statement_node.needs_scope else None   #one scope for the body's vars, emptied for every iteration
+
+        while True:
+            flag = self.eval_expression(condition)
+            if flag is not True:
+                if flag is False:
+                    return None
+                super().error(ErrorType.TYPE_ERROR,"Incompatible types for for loop condition: "+str(flag), statement_node.line)
+            if body_scope is None:
+                result = self.run_block(statements)
+            else:
+                body_scope.clear()
+                self.scope_stack.append(body_scope)
+                result = self.run_block(statements)
+                self.scope_stack.pop()
+            if result is not None:
+                return result
             self.run_statement(update)
-            flag = self.eval_expression(statement_node.get("condition"))
         
+    def try_statement(self, statement_node):   #python's try costs nothing until something is raised
+        handlers = statement_node.handlers
+        if handlers is None:   #catch table: exception string -> statements of the first catcher for it
+            handlers = {}
+            for catcher in statement_node.catchers:
+                handlers.setdefault(catcher.exception_type, catcher.statements)
+            statement_node.handlers = handlers
+        depth = len(self.scope_stack)
+        self.scope_stack.append({})
+        self.try_depth += 1
+        try:
+            result = self.run_block(statement_node.statements)
+        except BrewinException as e:
+            statements = handlers.get(e.exception_type)
+            if statements is None:   #not ours, an outer try (or caller) gets it
+                raise
+            del self.scope_stack[depth:]   #drop the block scopes the raise skipped
+        else:
+            self.scope_stack.pop()
+            return result
+        finally:
+            self.try_depth -= 1
+
+        self.scope_stack.append({})   #catcher scope
+        result = self.run_block(statements)
+        self.scope_stack.pop()
+        return result
+
+    def raise_exception(self, statement_node):
+        exception_type = self.eval_expression(statement_node.exception_type)
+        if not isinstance(exception_type, str):   #only strings can be raised
+            super().error(ErrorType.TYPE_ERROR, "Incompatible type for raise: " + self.get_type(exception_type), statement_node.line)
+        raise BrewinException(exception_type, statement_node.line)
         
     def return_from(self, statement_node):
-        expression = statement_node.get("expression")
-        self.function_output = self.eval_expression(expression)
-        # print("function output is set to",self.function_output)
-        # return self.eval_expression(expression)
+        expression = statement_node.expression
+        if self.is_self_tail_call(expression):   #return f(...) inside f: run_function reuses this frame
+            self.tail_call_args = [self.eval_expression(p) for p in expression.args]
+            return TAIL_CALL
+        if expression is None:   #return; gives nil
+            return (None,)
+        return (self.eval_expression(expression),)
 
 
-# test cases
-program = 1
-if True: 
-    program = """
-    func main() {
-    var a;
-    var b;
-    var c;
-    var d; var foo; var bar; var bletch; var prompt; var boo;
-    foo = "5";  
-    var _bar_bletch;
-    a = foo;
-    print(2 + inputi(3));
-        bar = 3 - 4;
-    print(bar);
-        bletch = 3 - (5 + 2);
-        prompt = "enter a number: ";
-
-        boo = inputi("Enter a number: ");
-    print(boo+89898989);
+# test cases, run with python interpreterv2.py (importing the module runs nothing)
+if __name__ == "__main__":
+    program = 1
+    if True: 
+        program = """
+        func main() {
+        var a;
+        var b;
+        var c;
+        var d; var foo; var bar; var bletch; var prompt; var boo;
+        foo = "5";  
+        var _bar_bletch;
+        a = foo;
+        print(2 + inputi(3));
+            bar = 3 - 4;
+        print(bar);
+            bletch = 3 - (5 + 2);
+            prompt = "enter a number: ";
 
-    }
+            boo = inputi("Enter a number: ");
+        print(boo+89898989);
 
-    """
-    program = """
-func foo() { 
- print("hello");
- /* no explicit return command */
-}
+        }
 
-func bar() {
-  return 1;  /* no return value specified */
-}
+        """
+        program = """
+    func foo() { 
+     print("hello");
+     /* no explicit return command */
+    }
 
-func main() {
-   var val;
-   val = nil;
-   print(bar() + 1);
-   if (foo() == val && true) { print("this should print!"); }
-}
+    func bar() {
+      return 1;  /* no return value specified */
+    }
 
-"""
+    func main() {
+       var val;
+       val = nil;
+       print(bar() + 1);
+       if (foo() == val && true) { print("this should print!"); }
+    }
+
+    """
 
 
 
-interpreter = Interpreter()
-interpreter.run(program)   
\ No newline at end of file
+    interpreter = Interpreter()
+    interpreter.run(program)   
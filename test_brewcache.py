@@ -0,0 +1,81 @@
+import os
+import pickle
+
+from brewcache import ASTCache
+from brewstruct import FieldPath
+from interpreterv2 import Interpreter
+
+STRUCT_PROGRAM = """
+struct node { value: int; next: node; }
+func main() {
+  var n;
+  n = new node;
+  n.next = new node;
+  n.next.value = 5;
+  print(n.next.value);
+}
+"""
+
+
+def program(i):   # a different small program for every i
+    return "func main() { print(" + str(i) + "); }"
+
+
+def ast_files(cache_dir):
+    return sorted(name for name in os.listdir(cache_dir) if name.endswith(".ast"))
+
+
+def test_counters():
+    cache = ASTCache()
+    first = cache.parse(program(1))
+    assert cache.parse(program(1)) is first
+    cache.parse(program(2))
+    assert cache.stats() == {"hits": 1, "disk_hits": 0, "misses": 2, "entries": 2}
+
+
+def test_disk_hits(tmp_path):
+    ASTCache(cache_dir=str(tmp_path)).parse(program(1))
+    cache = ASTCache(cache_dir=str(tmp_path))   # another process, same directory
+    cache.parse(program(1))
+    cache.parse(program(1))
+    assert cache.stats() == {"hits": 1, "disk_hits": 1, "misses": 0, "entries": 1}
+
+
+def test_lru_eviction():
+    cache = ASTCache(max_entries=2)
+    cache.parse(program(1))
+    cache.parse(program(2))
+    cache.parse(program(1))   # 2 is now the least recently used
+    cache.parse(program(3))
+    assert list(cache.entries) == [cache.key(program(1)), cache.key(program(3))]
+    cache.parse(program(2))
+    assert cache.stats()["misses"] == 4
+
+
+def test_trim_disk(tmp_path):
+    cache = ASTCache(cache_dir=str(tmp_path))
+    keys = [cache.key(program(i)) for i in range(3)]
+    for i, key in enumerate(keys):
+        cache.parse(program(i))
+        os.utime(cache.path(key), (1000 + i, 1000 + i))   # 0 is the oldest
+    sizes = [os.path.getsize(cache.path(key)) for key in keys]
+    cache.max_disk_bytes = sizes[1] + sizes[2]
+    cache.trim_disk()
+    assert ast_files(tmp_path) == sorted(key + ".ast" for key in keys[1:])
+    cache.max_disk_bytes = 0
+    cache.trim_disk()
+    assert ast_files(tmp_path) == []
+
+
+def test_struct_ast_round_trip(tmp_path):
+    ast = ASTCache(cache_dir=str(tmp_path)).parse(STRUCT_PROGRAM)
+    loaded = pickle.loads(pickle.dumps(ast, pickle.HIGHEST_PROTOCOL))
+    assign = loaded.functions[0].statements[3]   # n.next.value = 5;
+    assert type(assign.field_path) is FieldPath
+    assert (assign.field_path.base, assign.field_path.fields) == ("n", ("next", "value"))
+    for engine in Interpreter.ENGINES:   # every engine runs the copy read back from disk
+        cache = ASTCache(cache_dir=str(tmp_path))
+        interpreter = Interpreter(console_output=False, engine=engine, ast_cache=cache)
+        interpreter.run(STRUCT_PROGRAM)
+        assert cache.stats()["disk_hits"] == 1, engine
+        assert interpreter.get_output() == ["5"], engine
@@ -0,0 +1,40 @@
+import threading
+
+from brewparse import Parser, parse_program
+from element import Node
+
+
+def dump(node):   # everything the parser produced, source positions included
+    if isinstance(node, Node):
+        return (node.elem_type, node.line, node.col, tuple((key, dump(value)) for key, value in node.dict.items()))
+    if isinstance(node, list):
+        return tuple(dump(item) for item in node)
+    return node
+
+
+def program(i):   # programs of different sizes and layouts, so the parses really overlap
+    lines = ["struct p { x: int; }", "func f(a, b) {"]
+    for j in range(i % 7 + 1):
+        lines.append("  " * (j % 3) + f"if (a < {j}) {{ print(a * {i} + b, \"{j}\"); }} else {{ a = a - 1; }}")
+    lines += ["  return a;", "}", "func main() {", "  var q;", "  q = new p;", f"  q.x = f({i}, -2);", "}"]
+    return "\n".join(lines)
+
+
+def test_parallel_parses_match_serial():
+    programs = [program(i) for i in range(40)]
+    expected = [dump(Parser().parse(source)) for source in programs]
+    threads = 8
+    results = [None] * threads
+    start = threading.Barrier(threads)
+
+    def worker(n):
+        start.wait()
+        results[n] = [dump(parse_program(source)) for source in programs[n:] + programs[:n]]
+
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    for n in range(threads):
+        assert results[n] == expected[n:] + expected[:n], n
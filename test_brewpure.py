@@ -0,0 +1,61 @@
+from brewparse import parse_program
+from brewpure import MemoCache, PurityAnalyzer
+from interpreterv2 import Interpreter
+
+
+def pure_functions(program):
+    return PurityAnalyzer().analyze_program(parse_program(program))
+
+
+def run_memoized(program):   # output of every engine with memoize=True
+    outputs = []
+    for engine in Interpreter.ENGINES:
+        interpreter = Interpreter(console_output=False, engine=engine, memoize=True)
+        interpreter.run(program)
+        outputs.append(interpreter.get_output())
+    return outputs
+
+
+def test_impure_callee_makes_callers_impure():
+    program = """
+func say(x) { print(x); return x; }
+func wrap(x) { return say(x) + 1; }
+func outer(x) { return wrap(x) * 2; }
+func square(x) { return x * x; }
+func main() { print(outer(1)); }
+"""
+    assert pure_functions(program) == {("square", 1)}
+
+
+def test_wrapper_around_print_is_not_cached():
+    program = """
+func say(x) { print("say ", x); return x; }
+func wrap(x) { return say(x); }
+func main() { wrap(1); wrap(1); }
+"""
+    for output in run_memoized(program):
+        assert output == ["say 1", "say 1"]
+
+
+def test_memo_cache_lru():
+    cache = MemoCache(max_entries=2)
+    a, b, c = (cache.key(("f", 1), [i]) for i in range(3))
+    cache.put(a, 10)
+    cache.put(b, 11)
+    assert cache.get(a) == 10   # b is now the least recently used
+    cache.put(c, 12)
+    assert cache.get(b) is MemoCache.MISSING
+    assert cache.get(a) == 10 and cache.get(c) == 12
+    assert cache.stats() == {"hits": 3, "misses": 1, "entries": 2}
+
+
+def test_int_and_bool_keys_stay_apart():
+    cache = MemoCache()
+    assert cache.key(("f", 1), [1]) != cache.key(("f", 1), [True])
+    assert cache.key(("f", 1), [0]) != cache.key(("f", 1), [False])
+    program = """
+func is_true(x) { return x == true; }
+func main() { print(is_true(true)); print(is_true(1)); }
+"""
+    for output in run_memoized(program):
+        assert output == ["true", "false"]
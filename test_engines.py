@@ -0,0 +1,95 @@
+from interpreterv2 import Interpreter
+
+# Differential tests: every engine has to print the same lines and stop with
+# the same error as the tree walker. Run with python -m pytest.
+
+ENGINES = Interpreter.ENGINES
+
+
+def run(program, engine, **options):   # (output lines, error message or None)
+    interpreter = Interpreter(console_output=False, engine=engine, **options)
+    try:
+        interpreter.run(program)
+        error = None
+    except Exception as e:
+        error = str(e)
+    return interpreter.get_output(), error
+
+
+def check_engines(program, expected_output, expected_error=None, **options):
+    for engine in ENGINES:
+        output, error = run(program, engine, **options)
+        assert output == expected_output, engine
+        if expected_error is None:
+            assert error is None, engine
+        else:
+            assert error is not None and error.startswith(expected_error), engine
+
+
+def test_raise_caught_below_a_for_condition():   # the vm has to cut the value stack back to the right depth
+    program = """
+func h() { raise "x"; }
+func g(n) { try { print(100, h()); } catch "x" { print("caught"); } return n < 1; }
+func k() { try { raise "y"; } catch "y" { var z; } return 8; }
+func main() {
+  var i;
+  for (i = 0; g(i); i = i + 1) { print("body ", i); }
+  print(7, k());
+}
+"""
+    check_engines(program, ["caught", "body 0", "caught", "78"])
+
+
+def test_expression_statements_run():   # a bare expression is evaluated, side effects and errors included
+    program = """
+func f() { print("side"); return true; }
+func main() {
+  !f();
+  1 + "a";
+  print("end");
+}
+"""
+    check_engines(program, ["side"], "ErrorType.TYPE_ERROR on line 5")
+
+
+def check_optimized(program, **options):   # optimize=True must not change what any engine prints or raises
+    expected = run(program, "tree", **options)
+    for engine in ENGINES:
+        assert run(program, engine, **options) == expected, engine
+        assert run(program, engine, optimize=True, **options) == expected, engine
+
+
+def test_optimizer_keeps_pruned_blocks_with_vars():
+    check_engines("""
+func main() {
+  if (false) { print("t"); } else { var x; x = 2; print(x); }
+  if (1 > 2) { print("t"); } else { var y; y = 3; print(y); }
+  if (true) { var z; z = 4; print(z); }
+  var i;
+  for (i = 5; i < 3; i = i + 1) { var w; print("never"); }
+  print(i);
+  print("end");
+}
+""", ["2", "3", "4", "5", "end"], optimize=True)
+
+
+def test_optimizer_keeps_errors():
+    check_optimized('func main() { print(1 == "a", 1 != nil, true == 0); }')
+    check_optimized('func main() { print("before"); print(1 / 0); }')
+    check_optimized('func main() { print("before"); print(true && 5); }')
+    check_optimized('func main() { print("before"); print(1 < "a"); }')
+    check_optimized('func main() { print(-"a"); }')
+
+
+def test_optimizer_short_circuit_modes():
+    for program in ('func main() { print(false && 1 + "a"); print(true || 5); }',
+                    'func main() { print(false && 5); print("end"); }'):
+        check_optimized(program)
+        check_optimized(program, short_circuit=False)
+
+
+def test_duplicate_args_same_message():
+    program = """func f(a, b, a) { return a; }
+func main() { print("x"); f(1, 2, 3); }
+"""
+    check_engines(program, ["x"], "ErrorType.NAME_ERROR on line 1: Variable a defined more than once")